@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""Offline benchmark for kodekloud_downloader.
+
+Runs KodeKloudDownloader against a local fake KodeKloud API (catalog, course
+details, lessons and asset URLs) with a stubbed video backend, so performance
+changes can be measured reproducibly without network access.
+
+Each scenario runs in its own subprocess so CPU time and peak RSS are
+measured per scenario. CPU time includes the scenario's own child processes
+(e.g. --convert-workers), which are reaped when the downloader closes:
+
+    full    - empty download directory, downloads the whole fake catalog
+    resume  - runs again over the output of `full`, everything already present
+              (`full` is run first to prepare it even if not requested)
+
+Example:
+
+    python3 benchmark.py --courses 20 --modules 4 --lessons 10 --latency 0.05
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ('full', 'resume')  # in run order; each one starts from the tree the previous one left
+
+
+class FakeCatalog:
+    """Deterministic fake course catalog sized by the benchmark options."""
+
+    def __init__(self, options, base_url):
+        self.options = options
+        self.base_url = base_url
+
+    def course(self, index):
+        o = self.options
+        modules = []
+        for m in range(o.modules):
+            lessons = []
+            for n in range(o.lessons):
+                lesson_id = (index * o.modules + m) * o.lessons + n
+                is_video = o.video_every and n % o.video_every == o.video_every - 1
+                lessons.append({
+                    'id': lesson_id,
+                    'title': f"Lesson {m + 1}.{n + 1}",
+                    'type': 'video' if is_video else 'text',
+                    'updated_at': '2024-01-01T00:00:00Z',
+                })
+            modules.append({'id': index * 1000 + m, 'title': f"Module {m + 1}",
+                            'lessons_count': len(lessons), 'lessons': lessons})
+        return {'id': index, 'slug': f"course-{index}", 'title': f"Course {index}", 'modules': modules}
+
+    def lesson(self, lesson_id):
+        o = self.options
+        images = "".join(
+            f'<img src="{self.base_url}/assets/img/{(lesson_id + i) % o.image_pool}.png" alt="diagram {i}">'
+            for i in range(o.images))
+        pdf = f'<a href="{self.base_url}/assets/pdf/{lesson_id % o.image_pool}.pdf">Cheat sheet</a>'
+        paragraph = "<p>Lorem ipsum <b>dolor</b> sit amet, <code>kubectl get pods</code> consectetur.</p>"
+        body = paragraph * max(1, o.content_size // len(paragraph))
+        return {'id': lesson_id, 'content': f"<h2>Lesson {lesson_id}</h2>{body}{images}{pdf}",
+                'video_url': f"https://vimeo.com/{100000 + lesson_id}"}
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    catalog = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, data, headers=None):
+        self._send(200, json.dumps(data).encode(), headers=headers)
+
+    def do_GET(self):
+        options = self.catalog.options
+        time.sleep(options.latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+
+        if parts[:2] == ['api', 'courses'] and len(parts) == 2:
+            page = int(query.get('page', ['1'])[0])
+            limit = int(query.get('limit', ['50'])[0])
+            pages = -(-options.courses // limit)
+            indices = range((page - 1) * limit, min(page * limit, options.courses))
+            courses = [{'id': i, 'slug': f"course-{i}", 'title': f"Course {i}"} for i in indices]
+            self._send_json({'courses': courses, 'metadata': {
+                'page': page, 'total_pages': pages, 'total_count': options.courses,
+                'next_page': page + 1 if page < pages else None}})
+        elif parts[:2] == ['api', 'courses'] and len(parts) == 3:
+            index = int(parts[2].rsplit('-', 1)[1])
+            etag = f'"course-{index}"'
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, b'', headers={'ETag': etag})
+            else:
+                self._send_json(self.catalog.course(index), headers={'ETag': etag})
+        elif parts[:2] == ['api', 'lessons'] and len(parts) == 3:
+            self._send_json(self.catalog.lesson(int(parts[2])))
+        elif parts[0] == 'assets':
+            seed = url.path.encode()
+            body = (seed * (options.asset_size // len(seed) + 1))[:options.asset_size]
+            start = 0
+            if self.headers.get('Range'):
+                start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            if start:
+                self._send(206, body[start:], 'application/octet-stream',
+                           {'Content-Range': f"bytes {start}-{len(body) - 1}/{len(body)}"})
+            else:
+                self._send(200, body, 'application/octet-stream')
+        else:
+            self._send(404, b'{}')
+
+
+class StubVideoClient:
+    """Stands in for VideoClient: sleeps for a simulated transfer and writes a fixed-size .mkv."""
+
+    def __init__(self, size, seconds):
+        self.size = size
+        self.seconds = seconds
+
+    def download(self, video_url, output_path, orchestrator, variants=None):
+        with orchestrator.job({}, self.size):
+            time.sleep(self.seconds)
+            for path in (variants or {None: output_path}).values():
+                with open(f"{path}.mkv", 'wb') as f:
+                    chunk = b'\0' * 65536
+                    for offset in range(0, self.size, len(chunk)):
+                        f.write(chunk[:self.size - offset])
+
+    def close(self):
+        pass
+
+
+def run_worker(config):
+    """Run one scenario in this process and print its results as JSON."""
+    os.chdir(config['workdir'])
+    sys.path.insert(0, SCRIPT_DIR)
+    import kodekloud_downloader as kd
+
+    kd.API_BASE = f"{config['base_url']}/api"
+    kd.BASE_URL = config['base_url']
+
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        downloader = kd.KodeKloudDownloader(None)
+        downloader.token = 'benchmark'
+        downloader.session.headers.update({'Authorization': 'Bearer benchmark'})
+        downloader.video_client = StubVideoClient(config['video_size'], config['video_seconds'])
+        args = kd.parse_args(config['downloader_args'])
+        kd.configure_downloader(downloader, args)
+
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        downloader.metrics.started = time.time()
+        courses = downloader.iter_courses(args.page_size)
+        kd.download_courses(downloader, courses, args)
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        report = downloader.metrics.report()
+        downloader.close()
+    # Conversion worker processes have exited by now, so their CPU time is counted
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu += children.ru_utime + children.ru_stime
+
+    counters = report['counters']
+    lessons = counters.get('lessons_downloaded', 0) + counters.get('lessons_skipped', 0)
+    total_bytes = sum(stage['bytes'] for stage in report['stages'].values())
+    print(json.dumps({
+        'lessons': lessons,
+        'downloaded': counters.get('lessons_downloaded', 0),
+        'wall_time': wall,
+        'lessons_per_sec': lessons / wall if wall else 0,
+        'mb': total_bytes / 1048576,
+        'mb_per_sec': total_bytes / 1048576 / wall if wall else 0,
+        'cpu_time': cpu,
+        # ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'stages': report['stages'],
+    }))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark kodekloud_downloader against a local fake API.")
+    parser.add_argument('--courses', type=int, default=10, help="courses in the fake catalog")
+    parser.add_argument('--modules', type=int, default=4, help="modules per course")
+    parser.add_argument('--lessons', type=int, default=8, help="lessons per module")
+    parser.add_argument('--video-every', type=int, default=4,
+                        help="every Nth lesson is a video (0 for text only)")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds added to every request")
+    parser.add_argument('--content-size', type=int, default=20000, help="approximate HTML bytes per lesson")
+    parser.add_argument('--images', type=int, default=3, help="images per lesson")
+    parser.add_argument('--image-pool', type=int, default=50, help="distinct image URLs (controls reuse)")
+    parser.add_argument('--asset-size', type=int, default=100000, help="bytes per image/PDF")
+    parser.add_argument('--video-size', type=int, default=2 * 1024 * 1024, help="bytes per stub video")
+    parser.add_argument('--video-seconds', type=float, default=0.5, help="simulated seconds per video")
+    parser.add_argument('--scenarios', default='full,resume', help="comma-separated: full, resume (resume always runs after full)")
+    parser.add_argument('--json', metavar='PATH', help="also write the results as JSON")
+    parser.add_argument('--_worker', help=argparse.SUPPRESS)
+    args, downloader_args = parser.parse_known_args(argv)
+    requested = {name.strip() for name in args.scenarios.split(',') if name.strip()}
+    if not requested or requested.difference(SCENARIOS):
+        parser.error(f"--scenarios: expected a comma-separated list of {', '.join(SCENARIOS)}")
+    args.scenarios = [name for name in SCENARIOS if name in requested]
+    # Anything not recognised here (e.g. --video-workers 4) is passed to the downloader
+    args.downloader_args = downloader_args
+    return args
+
+
+def main():
+    options = parse_args()
+    if options._worker:
+        run_worker(json.loads(options._worker))
+        return
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAPIHandler)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    FakeAPIHandler.catalog = FakeCatalog(options, base_url)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    total = options.courses * options.modules * options.lessons
+    print(f"Fake catalog: {options.courses} courses, {total} lessons, latency {options.latency * 1000:.0f} ms")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='kodekloud-bench-') as workdir:
+        # Earlier scenarios also run, unreported, to prepare the tree for the requested ones
+        for scenario in SCENARIOS[:SCENARIOS.index(options.scenarios[-1]) + 1]:
+            config = {
+                'workdir': workdir,
+                'base_url': base_url,
+                'video_size': options.video_size,
+                'video_seconds': options.video_seconds,
+                'downloader_args': options.downloader_args,
+            }
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--_worker', json.dumps(config)],
+                                    check=True, capture_output=True, text=True).stdout
+            if scenario in options.scenarios:
+                results[scenario] = json.loads(output.strip().splitlines()[-1])
+
+    server.shutdown()
+
+    print(f"\n{'scenario':<10}{'lessons':>9}{'wall s':>9}{'lessons/s':>11}{'MB':>9}{'MB/s':>9}{'CPU s':>8}{'RSS MB':>9}")
+    for scenario, r in results.items():
+        print(f"{scenario:<10}{r['lessons']:>9}{r['wall_time']:>9.2f}{r['lessons_per_sec']:>11.1f}"
+              f"{r['mb']:>9.1f}{r['mb_per_sec']:>9.2f}{r['cpu_time']:>8.2f}{r['peak_rss_mb']:>9.1f}")
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'options': {k: v for k, v in vars(options).items() if not k.startswith('_')},
+                       'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
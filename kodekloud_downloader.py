@@ -13,29 +13,1786 @@ import os
 import requests
 import json
 import re
+import queue
+import threading
+import argparse
+import asyncio
+import base64
+import email.utils
+import errno
+import random
+import contextlib
+import collections
+import copy
+import heapq
+import itertools
+import csv
+import fnmatch
+import hashlib
+import importlib
+import importlib.util
+import multiprocessing
+import shutil
+import subprocess
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from tqdm import tqdm
-from urllib.parse import urljoin, unquote
-from bs4 import BeautifulSoup
-from markdownify import markdownify as md
-import yt_dlp
+from urllib.parse import urljoin, unquote, quote
+
+
+class _LazyModule:
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+class _LazyAttribute:
+    """Instance attribute built by factory(instance) on first access.
+
+    Once built (or assigned) it is a plain instance attribute. Creation is
+    serialised, so worker threads racing for it share one instance.
+    """
+
+    _lock = threading.RLock()
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with self._lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.factory(instance)
+        return instance.__dict__[self.name]
+
+
+# Heavy dependencies load only when the code that needs them runs, so listing
+# the catalog, --dry-run and text-only runs never import yt-dlp
+tqdm = _LazyModule('tqdm')
+bs4 = _LazyModule('bs4')
+markdownify = _LazyModule('markdownify')
+yt_dlp = _LazyModule('yt_dlp')
+# Optional: enables the asyncio HTTP backend (--async-http)
+aiohttp = _LazyModule('aiohttp') if importlib.util.find_spec('aiohttp') else None
+yarl = _LazyModule('yarl')  # Installed with aiohttp
+
+try:
+    import fcntl  # Locks the progress store when several nodes share it
+except ImportError:
+    fcntl = None
+
+# Transient transfer errors worth retrying or resuming (AsyncHTTPEngine re-raises aiohttp
+# errors as requests ones). SSL failures subclass ConnectionError but are permanent.
+RESUMABLE_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    asyncio.TimeoutError)
+PERMANENT_ERRORS = (requests.exceptions.SSLError,)
 
 # Configuration
 COOKIES_FILE = 'cookie.txt'
 PROGRESS_FILE = 'progress.json'
+PROGRESS_JOURNAL_FILE = 'progress.journal'  # Append-only log of completions since the last compaction
+PROGRESS_COMPACT_EVERY = 200  # Fold the journal into PROGRESS_FILE after this many completions
 BASE_URL = 'https://kodekloud.com'
 API_BASE = 'https://learn-api.kodekloud.com/api'
 LEARN_BASE = 'https://learn.kodekloud.com'
 DOWNLOAD_DIR = 'Downloads'
+OUTPUT_MANIFEST_FILE = os.path.join(DOWNLOAD_DIR, '.manifest.jsonl')  # Completed outputs (path, size, mtime)
+ASSET_STORE_DIR = os.path.join(DOWNLOAD_DIR, '.assets')  # Shared, content-addressed images and PDFs
+SYNC_STATE_DIR = '.sync'  # Per-course lesson fingerprints used by --sync
+LESSON_OUTPUT_SUFFIXES = ('.md', '.mkv', '.en.vtt')  # Files a lesson writes next to its title
+HTTP_CACHE_DIR = os.path.join('.cache', 'http')  # Cached catalog and course detail responses
+HTTP_CACHE_TTL = 6 * 3600  # Seconds a cached response is used without revalidation
+HTTP_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Oldest entries are evicted beyond this size
 VIDEO_QUALITY = '1080p'  # Default video quality
+FFMPEG = 'ffmpeg'  # Used to mux multi-quality variants (stream copy only)
 DOWNLOAD_VIDEOS = True  # Enable video downloads by default
+VIDEO_WORKERS = 2  # Concurrent video lesson downloads
+TEXT_WORKERS = 8  # Concurrent text/asset lesson downloads
+VIDEO_INFO_TTL = 1800  # Seconds extracted Vimeo format info is reused (manifest URLs expire)
+VIDEO_INFO_CACHE_SIZE = 64  # Extracted infos kept for videos that have not downloaded yet
+VIDEO_FRAGMENT_BUDGET = 15  # Fragment connections shared by all running video downloads
+VIDEO_RATE_LIMIT = None  # Aggregate video bandwidth cap in bytes/sec (None = unlimited)
+DISK_MIN_FREE = 1024 ** 3  # Free space kept on the download volume; larger jobs are deferred beyond it
+ESTIMATED_TEXT_LESSON_BYTES = 256 * 1024  # --dry-run size of a Markdown lesson with its images/PDFs
+ESTIMATED_VIDEO_SECONDS = 600  # --dry-run length of a video lesson without a duration
+ESTIMATED_VIDEO_BYTES_PER_SEC = 375000  # ~3 Mbit/s at 1080p; scaled by pixel count for lower qualities
+PREFETCH_LOOKAHEAD = 32  # Lesson payloads resolved ahead of the download workers, per lane
+PREFETCH_WORKERS = 4  # Concurrent lesson payload requests, per lane
+ASSET_WORKERS = 8  # Concurrent image/PDF downloads shared by all lessons
+HTTP_POOL_SIZE = VIDEO_WORKERS + TEXT_WORKERS + ASSET_WORKERS  # Max pooled keep-alive connections
+COURSES_PAGE_SIZE = 50  # Courses requested per catalog page
+CATALOG_WORKERS = 8  # Catalog pages fetched concurrently once the page count is known
+CONVERT_WORKERS = 0  # Processes for HTML-to-Markdown conversion; 0 converts in the text worker threads
+CONVERT_BATCH_SIZE = 8  # Most lessons sent to one conversion process per round trip
+COURSE_DETAILS_LOOKAHEAD = 2  # Course trees fetched ahead of the one being queued
+SCHEDULER_QUEUE_LIMIT = 1000  # Queued lessons per kind before course processing waits for the workers
+SCHEDULING_POLICIES = ('fifo', 'sjf', 'round-robin', 'text-first')  # Order in which queued lessons run
+CONTROL_POLL_INTERVAL = 2  # Seconds between checks of the --control file for new priorities
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Bytes read per chunk when streaming files to disk
+DOWNLOAD_RESUME_ATTEMPTS = 3  # Times an interrupted file download is resumed within a run
+HTTP_MAX_RETRIES = 5  # Retries per request on connection errors, 429 and 5xx responses
+HTTP_BACKOFF_BASE = 1.0  # Seconds; doubled per retry, with full jitter
+HTTP_BACKOFF_MAX = 60.0  # Upper bound for a single backoff or Retry-After wait
+HTTP_KEEPALIVE = 30  # Seconds an idle pooled connection is kept open (async backend)
+HTTP_TIMEOUT = (10, 60)  # Seconds to connect, and to wait for each read; a stalled request is retried or resumed
+
+class Metrics:
+    """Thread-safe counters and latency samples for a run, exportable as JSON, CSV or Prometheus text.
+
+    Stages (api, asset, convert, video) record one sample per operation with its
+    duration, bytes and whether it failed; counters track discrete events such
+    as retries and cache hits; course spans record per-course wall time.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self._courses = {}
+
+    def record(self, stage, seconds, nbytes=0, error=False):
+        with self._lock:
+            data = self._stages.setdefault(stage, {'durations': [], 'bytes': 0, 'errors': 0})
+            data['durations'].append(seconds)
+            data['bytes'] += nbytes
+            data['errors'] += bool(error)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Time a block as one sample of stage; the yielded dict can carry 'bytes' and 'error'."""
+        sample = {'bytes': 0, 'error': False}
+        start = time.perf_counter()
+        try:
+            yield sample
+        except BaseException:
+            sample['error'] = True
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, sample['bytes'], sample['error'])
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def course_span(self, course_slug, start, end):
+        """Extend a course's wall-time window with one finished lesson."""
+        with self._lock:
+            span = self._courses.setdefault(course_slug, {'start': start, 'end': end, 'lessons': 0})
+            span['start'] = min(span['start'], start)
+            span['end'] = max(span['end'], end)
+            span['lessons'] += 1
+
+    @staticmethod
+    def _percentile(values, fraction):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+    def report(self):
+        """Return the run metrics as a JSON-serializable dict."""
+        wall_time = time.time() - self.started
+        with self._lock:
+            stages = {}
+            for stage, data in self._stages.items():
+                durations = data['durations']
+                busy = sum(durations)
+                stages[stage] = {
+                    'count': len(durations),
+                    'errors': data['errors'],
+                    'bytes': data['bytes'],
+                    'seconds': round(busy, 3),
+                    'p50': round(self._percentile(durations, 0.5), 4),
+                    'p95': round(self._percentile(durations, 0.95), 4),
+                    'bytes_per_second': round(data['bytes'] / wall_time, 1) if wall_time else 0,
+                }
+            courses = {slug: {'wall_time': round(span['end'] - span['start'], 3), 'lessons': span['lessons']}
+                       for slug, span in self._courses.items()}
+            return {
+                'started': datetime.utcfromtimestamp(self.started).isoformat() + "Z",
+                'wall_time': round(wall_time, 3),
+                'stages': stages,
+                'counters': dict(self._counters),
+                'courses': courses,
+            }
+
+    def write_report(self, path):
+        """Write the report as CSV if path ends in .csv, JSON otherwise."""
+        report = self.report()
+        if path.lower().endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['kind', 'name', 'count', 'errors', 'bytes', 'seconds', 'p50', 'p95'])
+                for stage, data in report['stages'].items():
+                    writer.writerow(['stage', stage, data['count'], data['errors'], data['bytes'],
+                                     data['seconds'], data['p50'], data['p95']])
+                for name, value in report['counters'].items():
+                    writer.writerow(['counter', name, value, '', '', '', '', ''])
+                for slug, data in report['courses'].items():
+                    writer.writerow(['course', slug, data['lessons'], '', '', data['wall_time'], '', ''])
+                writer.writerow(['run', 'wall_time', '', '', '', report['wall_time'], '', ''])
+        else:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def write_prometheus(self, path):
+        """Write the report in the Prometheus text exposition format."""
+        report = self.report()
+        lines = ['# TYPE kodekloud_dl_stage_seconds summary']
+        for stage, data in report['stages'].items():
+            lines.append(f'kodekloud_dl_stage_seconds{{stage="{stage}",quantile="0.5"}} {data["p50"]}')
+            lines.append(f'kodekloud_dl_stage_seconds{{stage="{stage}",quantile="0.95"}} {data["p95"]}')
+            lines.append(f'kodekloud_dl_stage_seconds_sum{{stage="{stage}"}} {data["seconds"]}')
+            lines.append(f'kodekloud_dl_stage_seconds_count{{stage="{stage}"}} {data["count"]}')
+        lines.append('# TYPE kodekloud_dl_stage_errors_total counter')
+        lines += [f'kodekloud_dl_stage_errors_total{{stage="{stage}"}} {data["errors"]}'
+                  for stage, data in report['stages'].items()]
+        lines.append('# TYPE kodekloud_dl_stage_bytes_total counter')
+        lines += [f'kodekloud_dl_stage_bytes_total{{stage="{stage}"}} {data["bytes"]}'
+                  for stage, data in report['stages'].items()]
+        lines.append('# TYPE kodekloud_dl_events_total counter')
+        lines += [f'kodekloud_dl_events_total{{event="{name}"}} {value}'
+                  for name, value in report['counters'].items()]
+        lines.append('# TYPE kodekloud_dl_course_seconds gauge')
+        lines += [f'kodekloud_dl_course_seconds{{course="{slug}"}} {data["wall_time"]}'
+                  for slug, data in report['courses'].items()]
+        lines.append('# TYPE kodekloud_dl_run_seconds gauge')
+        lines.append(f'kodekloud_dl_run_seconds {report["wall_time"]}')
+        with open(path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+
+    def print_summary(self):
+        """Print throughput numbers for the summary block."""
+        report = self.report()
+        wall_time = report['wall_time'] or 1
+        counters = report['counters']
+        downloaded = counters.get('lessons_downloaded', 0)
+        total_bytes = sum(data['bytes'] for data in report['stages'].values())
+        print(f"Lessons: {downloaded} downloaded, {counters.get('lessons_skipped', 0)} skipped "
+              f"in {report['wall_time']:.1f}s ({downloaded / wall_time:.2f} lessons/s)")
+        print(f"Data: {total_bytes / 1048576:.1f} MB ({total_bytes / 1048576 / wall_time:.2f} MB/s)")
+        for stage, data in sorted(report['stages'].items()):
+            print(f"  {stage:<8} {data['count']:>6} ops  {data['errors']:>4} errors  "
+                  f"p50 {data['p50'] * 1000:8.1f} ms  p95 {data['p95'] * 1000:8.1f} ms")
+
+
+class KeyedLocks:
+    """One lock per key (a path or URL), kept only while a thread holds or waits for it."""
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}  # key -> [lock, threads holding or waiting]
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for outgoing requests.
+
+    Every success raises the limit by 1/limit (about +1 per round of requests).
+    A throttling response (429/503) halves it, at most once per second so a
+    burst of rejected in-flight requests only counts as one signal.
+    """
+
+    def __init__(self, initial=HTTP_POOL_SIZE, minimum=1, maximum=HTTP_POOL_SIZE):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease >= 1.0:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class RetryingTransport:
+    """Retries, backoff and adaptive concurrency on top of a requests-like transport.
+
+    Connection errors, timeouts, 429 and 5xx responses are retried up to
+    max_retries times with exponential backoff and full jitter, honouring
+    Retry-After. Permanent errors (invalid URL, SSL, redirect loops) raise at once.
+    Requests pass through an AdaptiveLimiter, which lowers concurrency
+    while the server pushes back. The limiter slot is held until response
+    headers arrive; body streaming is bounded by the worker pools. Every
+    request carries HTTP_TIMEOUT, so a stalled connection raises instead of
+    holding a worker forever.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, transport, metrics, limiter=None, max_retries=HTTP_MAX_RETRIES, timeout=HTTP_TIMEOUT):
+        self.transport = transport
+        self.metrics = metrics
+        self.limiter = limiter or AdaptiveLimiter()
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    @staticmethod
+    def _retry_after(response):
+        """Seconds requested by a Retry-After header, or None."""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+        if response is not None:
+            retry_after = self._retry_after(response)
+            if retry_after is not None:
+                delay = min(HTTP_BACKOFF_MAX, retry_after)
+        time.sleep(delay)
+
+    def _send(self, url, stream, headers):
+        """Issue one request under a limiter slot, which is released however the request ends."""
+        self.limiter.acquire()
+        try:
+            response = self.transport.get(url, stream=stream, headers=headers, timeout=self.timeout)
+        except BaseException:
+            self.limiter.release()
+            raise
+        self.limiter.release(response.status_code in self.THROTTLE_STATUSES)
+        return response
+
+    def get(self, url, stream=False, headers=None):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._send(url, stream, headers)
+            except PERMANENT_ERRORS:
+                raise
+            except RESUMABLE_ERRORS:
+                if attempt == self.max_retries:
+                    raise
+                self.metrics.count('http_retries')
+                self._backoff(attempt)
+                continue
+
+            throttled = response.status_code in self.THROTTLE_STATUSES
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            if throttled:
+                self.metrics.count('http_throttled')
+            self.metrics.count('http_retries')
+            response.close()
+            self._backoff(attempt, response)
+
+    def close(self):
+        if hasattr(self.transport, 'close'):
+            self.transport.close()
+
+
+class _AsyncResponse:
+    """Minimal requests.Response look-alike backed by an aiohttp response."""
+
+    def __init__(self, engine, response, body=None):
+        self._engine = engine
+        self._response = response
+        self._body = body
+        self.status_code = response.status
+        self.headers = response.headers
+        self.url = str(response.url)
+
+    @property
+    def content(self):
+        if self._body is None:
+            self._body = self._engine.run(self._response.read())
+        return self._body
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=8192):
+        while True:
+            chunk = self._engine.run(self._response.content.read(chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def close(self):
+        # aiohttp objects belong to the engine loop; releasing touches its connector and transport
+        self._engine.loop.call_soon_threadsafe(self._response.release)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncHTTPEngine:
+    """asyncio HTTP backend with a shared, size-limited keep-alive connection pool.
+
+    An aiohttp client runs on a dedicated event loop thread. get() has the same
+    calling convention as requests.Session.get, so scheduler workers can use it
+    as a drop-in transport while all their requests share one pool.
+    """
+
+    def __init__(self, session, pool_size=HTTP_POOL_SIZE):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="async-http", daemon=True)
+        self._thread.start()
+        self.client = self.run(self._open(session, pool_size))
+
+    async def _open(self, session, pool_size):
+        connector = aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=HTTP_KEEPALIVE)
+        client = aiohttp.ClientSession(connector=connector, headers=dict(session.headers),
+                                       timeout=self._client_timeout(HTTP_TIMEOUT))
+        # Carry over cookies loaded into the requests session, keeping their domains
+        for cookie in session.cookies:
+            domain = cookie.domain.lstrip('.')
+            response_url = yarl.URL(f"https://{domain}/") if domain else yarl.URL()
+            client.cookie_jar.update_cookies({cookie.name: cookie.value}, response_url)
+        return client
+
+    @staticmethod
+    def _client_timeout(timeout):
+        """Map a requests-style (connect, read) timeout to aiohttp.
+
+        There is no total limit (aiohttp defaults to 300 seconds, which would
+        cut off large files); sock_read bounds each wait for data instead.
+        """
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+
+    def run(self, coro):
+        """Run a coroutine on the engine loop and wait for its result."""
+        try:
+            return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+        except aiohttp.ClientError as e:
+            # Keep permanent failures distinguishable from transient ones for RetryingTransport
+            for aiohttp_error, requests_error in (
+                    (aiohttp.InvalidURL, requests.exceptions.InvalidURL),
+                    (aiohttp.ClientSSLError, requests.exceptions.SSLError),
+                    (aiohttp.TooManyRedirects, requests.TooManyRedirects),
+                    (aiohttp.ServerTimeoutError, requests.Timeout),
+                    (aiohttp.ClientPayloadError, requests.exceptions.ChunkedEncodingError)):
+                if isinstance(e, aiohttp_error):
+                    raise requests_error(str(e)) from e
+            raise requests.ConnectionError(str(e)) from e
+
+    async def _get(self, url, stream, headers, timeout):
+        if timeout is None:
+            response = await self.client.get(url, headers=headers)
+        else:
+            response = await self.client.get(url, headers=headers, timeout=self._client_timeout(timeout))
+        if stream:
+            return _AsyncResponse(self, response)
+        try:
+            body = await response.read()
+        finally:
+            response.release()
+        return _AsyncResponse(self, response, body)
+
+    def get(self, url, stream=False, headers=None, timeout=None):
+        """Issue a GET request; with stream=True the body is read lazily via iter_content."""
+        return self.run(self._get(url, stream, headers, timeout))
+
+    def close(self):
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+class HTTPCache:
+    """On-disk cache of JSON API responses keyed by URL.
+
+    Entries younger than the TTL are served straight from disk. Older entries
+    are revalidated with If-None-Match / If-Modified-Since, so an unchanged
+    resource costs one 304 round trip instead of a full download. The least
+    recently written entries are evicted once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir=HTTP_CACHE_DIR, ttl=HTTP_CACHE_TTL, max_bytes=HTTP_CACHE_MAX_BYTES, metrics=None):
+        self.cache_dir = cache_dir
+        self.metrics = metrics or Metrics()
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.refresh = False  # Set by --refresh: always refetch, but still store results
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.is_file())
+
+    def _path(self, url, vary):
+        key = hashlib.sha256(f"{vary}\n{url}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, path, entry):
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._size += os.path.getsize(path) - old_size
+                if self._size > self.max_bytes:
+                    self._evict()
+        except OSError as e:
+            print(f"Warning: Could not write HTTP cache entry: {e}")
+
+    def _evict(self):
+        entries = sorted((e for e in os.scandir(self.cache_dir) if e.name.endswith('.json')),
+                         key=lambda e: e.stat().st_mtime)
+        for entry in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def fetch(self, http, url, vary=''):
+        """GET a JSON resource through the cache. Returns (status_code, data)."""
+        path = self._path(url, vary)
+        entry = None if self.refresh else self._load(path)
+        if entry and time.time() - entry['stored_at'] < self.ttl:
+            self.metrics.count('cache_hits')
+            return 200, json.loads(entry['body'])
+
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        with self.metrics.timer('api') as sample:
+            response = http.get(url, headers=headers or None)
+            sample['error'] = response.status_code not in (200, 304)
+        if response.status_code == 304 and entry:
+            self.metrics.count('cache_revalidated')
+            entry['stored_at'] = time.time()
+            self._store(path, entry)
+            return 200, json.loads(entry['body'])
+        if response.status_code != 200:
+            return response.status_code, None
+
+        self.metrics.count('cache_misses')
+        body = response.content.decode('utf-8')
+        data = json.loads(body)
+        self._store(path, {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'stored_at': time.time(),
+            'body': body,
+        })
+        return 200, data
+
+
+class ProgressStore:
+    """Tracks completed lessons with an append-only journal and periodic compaction.
+
+    Each completion is appended and fsynced as one JSON line to the journal;
+    every PROGRESS_COMPACT_EVERY completions the full state is written
+    atomically to the progress file and the journal is truncated. A partial
+    last line left by a crash is cut off on load. Existing progress.json files
+    are the compacted snapshot, so they load without any migration step.
+
+    Several processes (e.g. --shard nodes) can share one store: appends take a
+    shared flock on a sidecar lock file and compaction takes an exclusive one,
+    merging whatever the other processes wrote before rewriting the snapshot.
+    """
+
+    def __init__(self, path, journal_path, compact_every=PROGRESS_COMPACT_EVERY):
+        self.path = path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._completed = set()
+        self.completed_this_run = set()
+        self._pending = 0
+        self.data = {"last_updated": None, "courses": {}}
+        self._lock_file = open(f"{self.path}.lock", 'a')
+        with self._file_lock(exclusive=True):
+            replayed = self._merge_from_disk()
+            self._drop_torn_line()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        if replayed:
+            # Fold a journal left by an interrupted run into the snapshot right away
+            self._compact()
+
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive):
+        """Hold the inter-process lock on the store (a no-op where flock is unavailable)."""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _merge_from_disk(self):
+        """Add the snapshot and journal on disk to the in-memory state. Returns the journal entries added."""
+        snapshot = self._load_snapshot()
+        for slug, course_data in snapshot["courses"].items():
+            self.data["courses"].setdefault(slug, {
+                "title": course_data.get("title"),
+                "completed_modules": course_data.get("completed_modules", []),
+                "completed_lessons": {}
+            })
+            for module_id, lesson_ids in course_data.get("completed_lessons", {}).items():
+                for lesson_id in lesson_ids:
+                    self._add(slug, course_data.get("title"), module_id, lesson_id)
+        return self._replay_journal()
+
+    def _load_snapshot(self):
+        """Load the compacted progress file."""
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                data.setdefault("courses", {})
+                return data
+            except Exception as e:
+                print(f"Warning: Could not load progress file: {e}")
+        return {"last_updated": None, "courses": {}}
+
+    def _replay_journal(self):
+        """Apply journal entries written since the last compaction."""
+        if not os.path.exists(self.journal_path):
+            return 0
+        replayed = 0
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash can leave a torn final line; everything before it is intact
+                    continue
+                if self._add(entry["course"], entry.get("title"), entry["module"], entry["lesson"]):
+                    replayed += 1
+        return replayed
+
+    def _drop_torn_line(self):
+        """Cut a partial final line left by a crash, so the next append starts on a line of its own."""
+        try:
+            with open(self.journal_path, 'rb+') as f:
+                data = f.read()
+                if data and not data.endswith(b'\n'):
+                    f.truncate(data.rfind(b'\n') + 1)
+        except FileNotFoundError:
+            pass
+
+    def _add(self, course_slug, course_title, module_id, lesson_id):
+        key = (course_slug, str(module_id), str(lesson_id))
+        if key in self._completed:
+            return False
+        self._completed.add(key)
+
+        courses = self.data["courses"]
+        if course_slug not in courses:
+            courses[course_slug] = {
+                "title": course_title,
+                "completed_modules": [],
+                "completed_lessons": {}
+            }
+        courses[course_slug]["completed_lessons"].setdefault(key[1], []).append(key[2])
+        return True
+
+    def is_completed(self, course_slug, module_id, lesson_id):
+        """Check if a lesson has been completed."""
+        return (course_slug, str(module_id), str(lesson_id)) in self._completed
+
+    def mark_completed(self, course_slug, course_title, module_id, lesson_id):
+        """Record a completed lesson in the journal."""
+        with self._lock:
+            self.completed_this_run.add((course_slug, str(module_id), str(lesson_id)))
+            if not self._add(course_slug, course_title, module_id, lesson_id):
+                return
+            entry = {"course": course_slug, "title": course_title,
+                     "module": str(module_id), "lesson": str(lesson_id)}
+            try:
+                with self._file_lock(exclusive=False):
+                    self._journal.write(json.dumps(entry) + "\n")
+                    self._journal.flush()
+                    os.fsync(self._journal.fileno())
+            except Exception as e:
+                print(f"Warning: Could not save progress: {e}")
+            self._pending += 1
+            if self._pending >= self.compact_every:
+                self._compact()
+
+    def _compact(self):
+        """Atomically rewrite the progress file and truncate the journal."""
+        try:
+            with self._file_lock(exclusive=True):
+                # Pick up completions other processes have compacted or journaled meanwhile
+                self._merge_from_disk()
+                self.data["last_updated"] = datetime.utcnow().isoformat() + "Z"
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.data, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                # Only drop journal entries once the snapshot containing them is durable
+                self._journal.truncate(0)
+                self._journal.seek(0)
+            self._pending = 0
+        except Exception as e:
+            print(f"Warning: Could not save progress: {e}")
+
+    def close(self):
+        """Compact any pending journal entries and close the journal."""
+        with self._lock:
+            if self._journal.closed:
+                return
+            if self._pending:
+                self._compact()
+            self._journal.close()
+            self._lock_file.close()
+
+
+class AssetStore:
+    """Content-addressed store for images and PDFs shared across the whole library.
+
+    Each file is stored once under objects/ by its SHA-256 and linked into
+    module folders (hardlink, falling back to symlink, then copy). index.jsonl
+    maps every fetched URL to its digest, so a URL already downloaded for any
+    lesson is never fetched again, and different URLs with the same content
+    share one object.
+
+    Several processes (e.g. --shard nodes) can share one store: a download
+    holds an flock byte-range lock for its URL on tmp/.lock, and a miss first
+    reads index lines the other processes appended, so each URL is fetched
+    into its .part file by one process at a time and normally only once.
+    """
+
+    def __init__(self, root=ASSET_STORE_DIR):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.index_path = os.path.join(root, 'index.jsonl')
+        self._lock = threading.Lock()
+        self._url_locks = KeyedLocks()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.index = {}
+        self._index_offset = 0
+        self._read_index()
+        self._index_file = open(self.index_path, 'a', encoding='utf-8')
+        self._lock_file = open(os.path.join(self.tmp_dir, '.lock'), 'a')
+
+    def _read_index(self):
+        """Add index lines appended since the last read, by this or another process."""
+        try:
+            with open(self.index_path, 'rb') as f:
+                f.seek(self._index_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line another process is still writing has no newline yet; read it next time
+        complete = data[:data.rfind(b'\n') + 1]
+        self._index_offset += len(complete)
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+                self.index[entry['url']] = entry['object']
+            except (ValueError, KeyError):
+                continue
+
+    @contextlib.contextmanager
+    def _url_file_lock(self, digest):
+        """Hold an inter-process lock for one URL (a no-op where fcntl is unavailable)."""
+        if fcntl is None:
+            yield
+            return
+        # One byte of the shared lock file per URL; threads of this process are already serialised per URL
+        offset = int(digest[:8], 16)
+        fcntl.lockf(self._lock_file, fcntl.LOCK_EX, 1, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_UN, 1, offset)
+
+    def _stored(self, url):
+        stored = self.index.get(url)
+        if stored and os.path.exists(os.path.join(self.objects_dir, stored)):
+            return os.path.join(self.objects_dir, stored)
+        return None
+
+    def _object_path(self, digest, ext):
+        return os.path.join(self.objects_dir, digest[:2], digest + ext)
+
+    @staticmethod
+    def _link(source, dest):
+        """Expose a stored object at dest without copying where the filesystem allows."""
+        try:
+            os.link(source, dest)
+        except FileExistsError:
+            pass
+        except OSError:
+            try:
+                os.symlink(os.path.relpath(source, os.path.dirname(dest)), dest)
+            except OSError:
+                shutil.copy2(source, dest)
+
+    def fetch(self, url, dest, download):
+        """Place the content of url at dest, calling download(url, tmp_path) only on a store miss.
+
+        download must write the content to tmp_path and return its SHA-256.
+        """
+        url_digest = hashlib.sha256(url.encode()).hexdigest()
+        with self._url_locks.hold(url), self._url_file_lock(url_digest):
+            with self._lock:
+                stored = self._stored(url)
+                if not stored:
+                    # Another process may have fetched it since this one loaded the index
+                    self._read_index()
+                    stored = self._stored(url)
+            if stored:
+                print(f"    Linking (stored): {os.path.basename(dest)}")
+                self._link(stored, dest)
+                return True
+
+            # Named after the URL so an interrupted transfer resumes on the next run
+            tmp_path = os.path.join(self.tmp_dir, url_digest + '.part')
+            print(f"  Downloading: {os.path.basename(dest)}")
+            try:
+                digest = download(url, tmp_path)
+            except InsufficientDiskSpace:
+                raise
+            except Exception as e:
+                print(f"  Failed to download file: {e}")
+                return False
+
+            object_path = self._object_path(digest, os.path.splitext(dest)[1].lower())
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            if os.path.exists(object_path):
+                # Same bytes already stored under another URL
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, object_path)
+            stored = os.path.relpath(object_path, self.objects_dir)
+            with self._lock:
+                self.index[url] = stored
+                self._index_file.write(json.dumps({'url': url, 'object': stored}) + "\n")
+                self._index_file.flush()
+            self._link(object_path, dest)
+            return True
+
+    def close(self):
+        with self._lock:
+            self._index_file.close()
+            self._lock_file.close()
+
+
+class ConversionPool:
+    """Runs convert_lesson_content in worker processes so conversion is not bound by the GIL.
+
+    Text workers call convert() and block on the result. A dispatcher thread
+    keeps one task per process in flight; whenever a process is free it sends
+    the next waiting lessons as a single chunk (the backlog split across the
+    processes, at most batch_size lessons), so a busy run pays one IPC round
+    trip per chunk rather than per lesson while an idle one still converts
+    each lesson immediately.
+
+    If a worker process dies (e.g. killed for memory), the pool is replaced
+    and the chunks it took down are sent to the new one once; a chunk that
+    breaks the pool a second time fails its lessons.
+    """
+
+    def __init__(self, workers, batch_size=CONVERT_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._requests = queue.Queue()
+        self._slots = threading.Semaphore(workers)
+        self._thread = threading.Thread(target=self._dispatch, name="convert-dispatch", daemon=True)
+        self._thread.start()
+
+    def convert(self, content_raw):
+        """Convert lesson content in a worker process. Returns (markdown, assets)."""
+        future = Future()
+        self._requests.put((content_raw, future))
+        return future.result()
+
+    def _dispatch(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            self._slots.acquire()
+            chunk = [request]
+            size = min(self.batch_size, 1 + self._requests.qsize() // self.workers)
+            while len(chunk) < size:
+                try:
+                    request = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._requests.put(None)
+                    break
+                chunk.append(request)
+            self._submit(chunk)
+
+    def _new_executor(self):
+        # spawn: forking a process that already runs many threads is not safe
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _replace_executor(self, broken):
+        """Swap in a new process pool, unless another chunk already replaced the broken one."""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            print("Warning: A conversion process died; starting new ones")
+            broken.shutdown(wait=False)
+            self._executor = self._new_executor()
+
+    def _submit(self, chunk, retry=True):
+        with self._lock:
+            executor = self._executor
+        try:
+            task = executor.submit(convert_batch, [content for content, _ in chunk])
+        except Exception as e:
+            task = Future()
+            task.set_exception(e)
+
+        def resolve(task):
+            try:
+                results = task.result()
+            except BrokenProcessPool as e:
+                self._replace_executor(executor)
+                if retry:
+                    # Usually collateral of another chunk's crash; its slot carries over to the retry
+                    self._submit(chunk, retry=False)
+                    return
+                results = [(False, e)] * len(chunk)
+            except Exception as e:
+                results = [(False, e)] * len(chunk)
+            self._slots.release()
+            for (_, future), (ok, value) in zip(chunk, results):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        task.add_done_callback(resolve)
+
+    def close(self):
+        self._requests.put(None)
+        self._thread.join()
+        with self._lock:
+            executor = self._executor
+        executor.shutdown()
+
+
+class LessonPrefetcher:
+    """Resolves lesson payloads in the background ahead of the download workers.
+
+    Worker threads fetch the first `lookahead` scheduled lessons in the order
+    the download workers will take them: order(n) returns the next n
+    (lesson_id, course_id) keys of the scheduler's queue, so a policy or
+    priority change also changes what is prefetched. Without it lessons are
+    fetched in schedule order. get() returns a prefetched payload, waits for
+    one in flight, or fetches inline if prefetching has not reached that lesson.
+    """
+
+    def __init__(self, fetch, lookahead=PREFETCH_LOOKAHEAD, workers=PREFETCH_WORKERS, order=None):
+        self._fetch = fetch
+        self.lookahead = lookahead
+        self.order = order
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._futures = {}
+        self._threads = [threading.Thread(target=self._run, name=f"prefetch-{i+1}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def schedule(self, lesson_id, course_id):
+        """Register a lesson payload for background fetching."""
+        key = (lesson_id, course_id)
+        with self._wakeup:
+            if key not in self._futures:
+                self._futures[key] = Future()
+                self._wakeup.notify()
+
+    def _pick(self):
+        """Claim the next unfetched lesson within the lookahead window, or return None."""
+        window = self.order(self.lookahead) if self.order else itertools.islice(self._futures, self.lookahead)
+        for key in window:
+            future = self._futures.get(key)
+            if future is not None and not future.running() and not future.done():
+                future.set_running_or_notify_cancel()
+                return key, future
+        return None
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                picked = self._pick()
+                while picked is None and not self._closed:
+                    # Reordering the scheduler queue does not notify, so look again periodically
+                    self._wakeup.wait(1.0)
+                    picked = self._pick()
+                if picked is None:
+                    return
+            key, future = picked
+            try:
+                future.set_result(self._fetch(*key))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _take(self, lesson_id, course_id):
+        """Remove a scheduled lesson; returns its future if a fetch was started."""
+        with self._wakeup:
+            future = self._futures.pop((lesson_id, course_id), None)
+            # The window moves on by one lesson
+            self._wakeup.notify()
+        if future is None or future.cancel():
+            return None
+        return future
+
+    def get(self, lesson_id, course_id):
+        """Return the (status_code, data) payload for a lesson."""
+        future = self._take(lesson_id, course_id)
+        if future is None:
+            return self._fetch(lesson_id, course_id)
+        return future.result()
+
+    def discard(self, lesson_id, course_id):
+        """Drop a scheduled lesson that turned out not to need its payload."""
+        self._take(lesson_id, course_id)
+
+    def close(self):
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify_all()
+
+
+class VideoClient:
+    """Long-lived yt-dlp client that reuses configured instances and extracted video info.
+
+    Each video worker thread keeps one YoutubeDL, so extractor setup and the
+    cookie file load happen once per thread instead of once per lesson.
+    Extracted format info is cached per Vimeo id for VIDEO_INFO_TTL seconds
+    until the video is saved, so a retried or deferred download reuses it and
+    only re-extracts when the cached manifest no longer works. At most
+    VIDEO_INFO_CACHE_SIZE entries are kept; expired ones are pruned first.
+
+    Several quality variants of one video are fetched in a single pass: one
+    video-only stream per quality plus a single audio track and one set of
+    subtitles, then each variant is muxed by stream copy (no re-encoding).
+    """
+
+    def __init__(self, cookie_file, info_ttl=VIDEO_INFO_TTL, info_cache_size=VIDEO_INFO_CACHE_SIZE):
+        self.cookie_file = cookie_file
+        self.info_ttl = info_ttl
+        self.info_cache_size = info_cache_size
+        self._local = threading.local()
+        self._instances = []
+        self._info = {}
+        self._lock = threading.Lock()
+
+    def _options(self):
+        return {
+            # Replaced per download by video_format(quality)
+            'format': video_format(VIDEO_QUALITY),
+            # Fragment count and rate limit are assigned by the orchestrator
+            'concurrent_fragment_downloads': 1,
+            'cookiefile': self.cookie_file,
+            'merge_output_format': 'mkv',
+            'writesubtitles': True,
+            'writeautomaticsub': True,
+            'subtitleslangs': ['en'],
+            'http_headers': {'Referer': 'https://learn.kodekloud.com/'},
+            'quiet': True,
+            'no_warnings': True,
+        }
+
+    def _ydl(self):
+        """Return this thread's YoutubeDL, creating it on first use."""
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(self._options())
+            self._local.ydl = ydl
+            with self._lock:
+                self._instances.append(ydl)
+        return ydl
+
+    @staticmethod
+    def _video_id(video_url):
+        return video_url.rstrip('/').split('/')[-1]
+
+    def extract(self, video_url, refresh=False):
+        """Return format info for a Vimeo player URL, from cache when still fresh."""
+        vimeo_id = self._video_id(video_url)
+        with self._lock:
+            cached = self._info.get(vimeo_id)
+        if cached and not refresh and time.time() - cached[0] < self.info_ttl:
+            return copy.deepcopy(cached[1]), True
+        ydl = self._ydl()
+        info = ydl.sanitize_info(ydl.extract_info(video_url, download=False), True)
+        now = time.time()
+        with self._lock:
+            self._info.pop(vimeo_id, None)
+            for key in [key for key, (stamp, _) in self._info.items() if now - stamp >= self.info_ttl]:
+                del self._info[key]
+            # Dicts keep insertion order, so the first entries are the oldest
+            while self._info and len(self._info) >= self.info_cache_size:
+                del self._info[next(iter(self._info))]
+            self._info[vimeo_id] = (now, info)
+        return copy.deepcopy(info), False
+
+    def download(self, video_url, output_path, orchestrator, variants=None):
+        """Download a video under an orchestrator slot, with subtitles next to output_path.
+
+        variants maps each quality to the path (without .mkv) it is saved to;
+        by default a single VIDEO_QUALITY copy is saved as output_path.mkv.
+        """
+        variants = variants or {VIDEO_QUALITY: output_path}
+        info, from_cache = self.extract(video_url)
+        ydl = self._ydl()
+        ydl.params['outtmpl']['subtitle'] = f'{output_path}.%(ext)s'
+        split = self._split_formats(info, variants) if len(variants) > 1 else None
+        if split:
+            def run(info):
+                self._download_split(ydl, info, split, variants)
+            size = sum(estimate_video_bytes({'requested_formats': [f], 'duration': info.get('duration')})
+                       for f in self._unique(split))
+        else:
+            # One quality, or no separate audio/video streams to share: download each variant on its own
+            def run(info):
+                for quality, path in variants.items():
+                    self._download_merged(ydl, info, quality, path)
+            size = sum(estimate_video_bytes(info, quality) for quality in variants)
+        with orchestrator.job(ydl.params, size):
+            try:
+                run(info)
+            except yt_dlp.utils.DownloadError:
+                if not from_cache:
+                    raise
+                # Cached manifest URLs may have expired; extract once more and retry
+                info, _ = self.extract(video_url, refresh=True)
+                run(info)
+        # Saved videos are not downloaded again, so their info is no longer needed
+        with self._lock:
+            self._info.pop(self._video_id(video_url), None)
+
+    @staticmethod
+    def _set_format(ydl, spec):
+        """Point a reused YoutubeDL at a new format spec.
+
+        YoutubeDL compiles params['format'] into format_selector once in
+        __init__, so changing the param alone would keep the old selector.
+        """
+        ydl.params['format'] = spec
+        ydl.format_selector = ydl.build_format_selector(spec)
+
+    def _download_merged(self, ydl, info, quality, path):
+        """Let yt-dlp pick, download and merge (stream copy) the best formats for one quality."""
+        ydl.params['outtmpl']['default'] = f'{path}.%(ext)s'
+        self._set_format(ydl, video_format(quality))
+        ydl.process_ie_result(copy.deepcopy(info), download=True)
+
+    @staticmethod
+    def _split_formats(info, variants):
+        """Pick a video-only format per quality and one shared audio-only format, or None if there are none."""
+        formats = info.get('formats') or []
+        videos = [f for f in formats if f.get('height') and f.get('vcodec') not in (None, 'none')
+                  and f.get('acodec') == 'none']
+        audios = [f for f in formats if f.get('acodec') not in (None, 'none') and f.get('vcodec') == 'none']
+        if not videos or not audios:
+            return None
+        picked = {'audio': max(audios, key=lambda f: f.get('abr') or f.get('tbr') or 0)}
+        for quality in variants:
+            height = int(str(quality).lower().rstrip('p'))
+            fitting = [f for f in videos if f['height'] <= height] or [min(videos, key=lambda f: f['height'])]
+            picked[quality] = max(fitting, key=lambda f: (f['height'], f.get('tbr') or 0))
+        return picked
+
+    @staticmethod
+    def _unique(split):
+        return list({f['format_id']: f for f in split.values()}.values())
+
+    def _download_split(self, ydl, info, split, variants):
+        """Download the picked streams once each, then mux every variant by stream copy."""
+        base = next(iter(variants.values()))
+        ydl.params['outtmpl']['default'] = f'{base}.f%(format_id)s.%(ext)s'
+        self._set_format(ydl, ','.join(f['format_id'] for f in self._unique(split)))
+        result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+        files = {d['format_id']: d['filepath'] for d in result.get('requested_downloads', [])}
+        audio = files[split['audio']['format_id']]
+        for quality, path in variants.items():
+            tmp_path = f'{path}.tmp.mkv'
+            subprocess.run([FFMPEG, '-y', '-loglevel', 'error', '-i', files[split[quality]['format_id']],
+                            '-i', audio, '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', tmp_path],
+                           check=True, capture_output=True)
+            os.replace(tmp_path, f'{path}.mkv')
+        # Intermediate streams are kept until every variant is muxed, so a retry can reuse them
+        for path in set(files.values()):
+            os.remove(path)
+
+    def close(self):
+        with self._lock:
+            for ydl in self._instances:
+                ydl.close()
+            self._instances.clear()
+
+
+class VideoOrchestrator:
+    """Runs video downloads under a global fragment budget and aggregate rate limit.
+
+    At most max_jobs videos download at once, and each gets a fixed share
+    when it starts: budget // max_jobs fragment connections, and the rate
+    limit split across every connection of every slot. yt-dlp copies its
+    params into the fragment downloader and reads the fragment count once per
+    format, so a running download cannot be re-split; fixed shares keep the
+    totals within the budget and cap however the jobs overlap.
+    """
+
+    def __init__(self, max_jobs=VIDEO_WORKERS, fragment_budget=VIDEO_FRAGMENT_BUDGET, rate_limit=VIDEO_RATE_LIMIT,
+                 disk=None):
+        self.disk = disk or DiskSpaceGuard()
+        # Every running video needs at least one fragment connection
+        self.max_jobs = max(1, min(max_jobs, fragment_budget))
+        self.fragment_budget = fragment_budget
+        self.rate_limit = rate_limit
+        self._slots = threading.BoundedSemaphore(self.max_jobs)
+
+    def share(self):
+        """Return the (fragments, ratelimit) each running video is given."""
+        fragments = max(1, self.fragment_budget // self.max_jobs)
+        if not self.rate_limit:
+            return fragments, None
+        # The limit applies per fragment connection, so split it across all of them
+        return fragments, max(1, self.rate_limit // (fragments * self.max_jobs))
+
+    @contextlib.contextmanager
+    def job(self, params, size=0):
+        """Hold a video slot and size bytes of disk space while a download runs with the given yt-dlp params."""
+        with self._slots, self.disk.reserve(size):
+            params['concurrent_fragment_downloads'], params['ratelimit'] = self.share()
+            yield
+
+
+class InsufficientDiskSpace(OSError):
+    """A download was refused because it would take free space below the watermark."""
+
+    def __init__(self, size, available):
+        super().__init__(errno.ENOSPC, f"not enough disk space: need {size / 1048576:.1f} MB, "
+                                       f"{max(0, available) / 1048576:.1f} MB available above the free-space watermark")
+        self.size = size
+
+    def __str__(self):
+        return self.strerror
+
+
+class DiskSpaceGuard:
+    """Admits writes only while free space on the download volume stays above a watermark.
+
+    Each download reserves its expected size (Content-Length for files, the
+    format filesize for videos) before writing and releases it when done, so
+    concurrent downloads cannot jointly overcommit the disk. A download that
+    does not fit is refused up front with InsufficientDiskSpace instead of
+    failing halfway; the scheduler defers it and keeps running smaller jobs.
+    """
+
+    def __init__(self, path=DOWNLOAD_DIR, min_free=DISK_MIN_FREE):
+        self.path = path
+        self.min_free = min_free
+        self._lock = threading.Lock()
+        self._reserved = 0
+
+    def available(self):
+        """Bytes that can still be written before free space reaches the watermark."""
+        path = os.path.abspath(self.path)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        return shutil.disk_usage(path).free - self.min_free - self._reserved
+
+    @contextlib.contextmanager
+    def reserve(self, size):
+        """Hold size bytes of disk space for a download, or raise InsufficientDiskSpace."""
+        with self._lock:
+            available = self.available()
+            if size > available:
+                raise InsufficientDiskSpace(size, available)
+            self._reserved += size
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reserved -= size
+
+
+class OutputManifest:
+    """Persistent index of completed output files, loaded once and checked in memory.
+
+    Resuming a large library then needs no per-lesson stat calls. A path that
+    is not in the manifest is looked up in a single os.scandir listing of its
+    directory, so trees downloaded before the manifest existed are picked up
+    with one directory scan instead of one stat per file. verify() reconciles
+    the manifest with the disk in bulk.
+    """
+
+    def __init__(self, path=OUTPUT_MANIFEST_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._files = {}
+        self._dirs = set()
+        self._listings = {}
+        lines = self._load()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if lines > 2 * len(self._files) + 100:
+            self._rewrite()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        lines = 0
+        if not os.path.exists(self.path):
+            return lines
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('removed'):
+                    self._files.pop(entry['path'], None)
+                else:
+                    self._files[entry['path']] = (entry['size'], entry['mtime'])
+        # One stat per directory: outputs under a deleted course or module folder are dropped
+        self._dirs = {d for d in {os.path.dirname(path) for path in self._files} if os.path.isdir(d)}
+        self._files = {path: entry for path, entry in self._files.items() if os.path.dirname(path) in self._dirs}
+        return lines
+
+    def _rewrite(self):
+        """Replace the manifest with one line per current entry."""
+        # Unique per process, since --shard nodes may rewrite a shared manifest at the same time
+        tmp_path = f"{self.path}.{os.getpid()}-{random.getrandbits(32):08x}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for path, (size, mtime) in self._files.items():
+                f.write(json.dumps({'path': path, 'size': size, 'mtime': mtime}) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def _write(self, entry):
+        if not self._file.closed:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def _record(self, path, stat_result):
+        self._files[path] = (stat_result.st_size, stat_result.st_mtime)
+        self._dirs.add(os.path.dirname(path))
+        self._write({'path': path, 'size': stat_result.st_size, 'mtime': stat_result.st_mtime})
+
+    def _scan(self, directory):
+        try:
+            with os.scandir(directory) as entries:
+                return {entry.name: entry for entry in entries if entry.is_file()}
+        except FileNotFoundError:
+            return {}
+
+    def has(self, path):
+        """Check whether path is a completed output."""
+        path = os.path.normpath(path)
+        with self._lock:
+            if path in self._files:
+                return True
+            directory = os.path.dirname(path)
+            if directory not in self._listings:
+                self._listings[directory] = self._scan(directory)
+            entry = self._listings[directory].get(os.path.basename(path))
+            if entry is None:
+                return False
+            self._record(path, entry.stat())
+            return True
+
+    def add(self, path):
+        """Record a file that has just been written."""
+        path = os.path.normpath(path)
+        stat_result = os.stat(path)
+        with self._lock:
+            self._record(path, stat_result)
+
+    def discard(self, path):
+        """Forget a file that was removed or renamed."""
+        path = os.path.normpath(path)
+        with self._lock:
+            self._listings.get(os.path.dirname(path), {}).pop(os.path.basename(path), None)
+            if self._files.pop(path, None) is not None:
+                self._write({'path': path, 'removed': True})
+
+    def remove_dir(self, directory):
+        """Delete the recorded outputs in a directory, then the directory itself if nothing else is left."""
+        directory = os.path.normpath(directory)
+        with self._lock:
+            paths = [path for path in self._files if os.path.dirname(path) == directory]
+        for path in paths:
+            self.discard(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._dirs.discard(directory)
+            self._listings.pop(directory, None)
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+    def ensure_dir(self, directory):
+        """Create a directory unless it is already known to exist."""
+        directory = os.path.normpath(directory)
+        with self._lock:
+            if directory in self._dirs:
+                return
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._dirs.add(directory)
+
+    def verify(self):
+        """Rescan every manifest directory and drop entries that are missing or changed size."""
+        by_dir = {}
+        with self._lock:
+            for path in self._files:
+                by_dir.setdefault(os.path.dirname(path), []).append(path)
+            missing = changed = 0
+            for directory, paths in by_dir.items():
+                listing = self._scan(directory)
+                self._listings[directory] = listing
+                for path in paths:
+                    entry = listing.get(os.path.basename(path))
+                    if entry is None:
+                        missing += 1
+                        del self._files[path]
+                        continue
+                    stat_result = entry.stat()
+                    if stat_result.st_size != self._files[path][0]:
+                        changed += 1
+                        del self._files[path]
+                    else:
+                        self._files[path] = (stat_result.st_size, stat_result.st_mtime)
+                if not listing:
+                    self._dirs.discard(directory)
+            self._file.close()
+            self._rewrite()
+            self._file = open(self.path, 'a', encoding='utf-8')
+        print(f"Verified {sum(len(p) for p in by_dir.values())} files in {len(by_dir)} directories: "
+              f"{missing} missing, {changed} changed")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class SyncState:
+    """Per-course lesson fingerprints for incremental syncs.
+
+    A fingerprint records each lesson's title, type, update timestamp and output
+    path. On the next --sync run the course tree is diffed against it: only new
+    or changed lessons are scheduled, renamed or moved lessons have their files
+    renamed, and outputs of removed lessons are deleted. A text lesson that
+    moves to another module folder is downloaded again, since its images and
+    PDFs live in the old folder; module folders left empty are removed.
+
+    The old copy of a changed lesson is kept until its replacement completes:
+    files at the same path are set aside as <file>.old, and commit() deletes
+    them (or the files at the old path) once the lesson is marked complete, or
+    puts them back if it failed.
+
+    The fingerprint a course will get is written to <slug>.pending.json when
+    it is planned, so only the slugs of planned courses stay in memory until
+    commit() settles them at the end of the run.
+    """
+
+    def __init__(self, manifest, video_suffixes=(), state_dir=SYNC_STATE_DIR):
+        self.manifest = manifest
+        # Extra quality variants (e.g. .480p.mkv) move and get removed with their lesson
+        self.suffixes = tuple(dict.fromkeys(LESSON_OUTPUT_SUFFIXES + tuple(video_suffixes)))
+        self.state_dir = state_dir
+        self._planned = []
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def _path(self, course_slug, pending=False):
+        return os.path.join(self.state_dir, f"{course_slug}.pending.json" if pending else f"{course_slug}.json")
+
+    def _read(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load(self, course_slug):
+        return (self._read(self._path(course_slug)) or {}).get('lessons', {})
+
+    def _save(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def fingerprint(lesson, module_id, module_dir, sanitize):
+        """Describe a lesson by the fields that decide whether it must be re-downloaded."""
+        updated = None
+        for key in ('updated_at', 'updatedAt', 'last_updated', 'modified_at'):
+            if lesson.get(key):
+                updated = lesson[key]
+                break
+        title = lesson.get('title', 'Unknown Lesson')
+        return {
+            'title': title,
+            'type': lesson.get('type'),
+            'updated': updated,
+            'module': str(module_id),
+            'path': os.path.join(module_dir, sanitize(title)),
+        }
+
+    def _remove_outputs(self, base_path, set_aside=False):
+        for suffix in self.suffixes:
+            path = base_path + suffix + ('.old' if set_aside else '')
+            self.manifest.discard(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _set_aside(self, base_path):
+        """Move a changed lesson's files out of the way of its replacement, keeping them as .old."""
+        for suffix in self.suffixes:
+            if os.path.exists(base_path + suffix):
+                os.replace(base_path + suffix, base_path + suffix + '.old')
+                self.manifest.discard(base_path + suffix)
+
+    def _restore(self, base_path):
+        """Put set-aside files back where a failed replacement left nothing."""
+        for suffix in self.suffixes:
+            old_path = base_path + suffix + '.old'
+            if not os.path.exists(old_path):
+                continue
+            if os.path.exists(base_path + suffix):
+                os.remove(old_path)
+            else:
+                os.replace(old_path, base_path + suffix)
+                self.manifest.add(base_path + suffix)
+
+    def _move_outputs(self, old_base, new_base):
+        """Rename a lesson's files to its new title. Returns False if nothing was moved."""
+        moved = False
+        for suffix in self.suffixes:
+            if os.path.exists(old_base + suffix):
+                self.manifest.ensure_dir(os.path.dirname(new_base))
+                os.replace(old_base + suffix, new_base + suffix)
+                self.manifest.discard(old_base + suffix)
+                self.manifest.add(new_base + suffix)
+                moved = True
+        return moved
+
+    def plan(self, course_slug, course_tree, selected_ids, sanitize):
+        """Diff a course tree against the last sync and return the lessons to download.
+
+        course_tree is a list of (lesson, module_id, module_dir) for every lesson
+        in the course; only lessons whose id is in selected_ids are scheduled.
+        """
+        previous = self._load(course_slug)
+        current = {}
+        scheduled = []
+        stale = {}  # lesson_id -> previous entry, whose files go once the replacement completes
+        counts = {'new': 0, 'changed': 0, 'renamed': 0, 'removed': 0, 'unchanged': 0}
+
+        for lesson, module_id, module_dir in course_tree:
+            lesson_id = str(lesson.get('id'))
+            entry = self.fingerprint(lesson, module_id, module_dir, sanitize)
+            current[lesson_id] = entry
+            if lesson_id not in selected_ids:
+                continue
+
+            old = previous.get(lesson_id)
+            if old is None:
+                counts['new'] += 1
+                scheduled.append((lesson, module_id, module_dir))
+            elif (old['type'], old['updated']) != (entry['type'], entry['updated']):
+                counts['changed'] += 1
+                if old['path'] == entry['path']:
+                    self._set_aside(old['path'])
+                stale[lesson_id] = old
+                scheduled.append((lesson, module_id, module_dir))
+            elif os.path.dirname(old['path']) != os.path.dirname(entry['path']) and lesson_kind(lesson) == 'text':
+                # Assets are re-linked from the asset store next to the new Markdown file
+                counts['changed'] += 1
+                stale[lesson_id] = old
+                scheduled.append((lesson, module_id, module_dir))
+            elif old['path'] != entry['path']:
+                counts['renamed'] += 1
+                if not self._move_outputs(old['path'], entry['path']):
+                    scheduled.append((lesson, module_id, module_dir))
+            else:
+                counts['unchanged'] += 1
+
+        for lesson_id, old in previous.items():
+            if lesson_id not in current:
+                counts['removed'] += 1
+                self._remove_outputs(old['path'])
+
+        # Module folders no lesson maps to any more (unselected lessons keep their old files in
+        # place); removed by commit(), as they may still hold the old copy of a moved lesson
+        kept = {os.path.dirname(entry['path']) for entry in current.values()}
+        kept.update(os.path.dirname(old['path']) for lesson_id, old in previous.items()
+                    if lesson_id in current and lesson_id not in selected_ids)
+        vacated = {os.path.dirname(old['path']) for old in previous.values()} - kept
+
+        # Settle everything but the scheduled lessons now; those are decided by commit()
+        scheduled_ids = {str(lesson.get('id')) for lesson, _, _ in scheduled}
+        lessons, pending = {}, {}
+        for lesson_id, entry in current.items():
+            if lesson_id not in selected_ids:
+                if lesson_id in previous:
+                    lessons[lesson_id] = previous[lesson_id]
+            elif lesson_id in scheduled_ids:
+                pending[lesson_id] = entry
+            else:
+                lessons[lesson_id] = entry
+        try:
+            self._save(self._path(course_slug, pending=True), {'lessons': lessons, 'scheduled': pending,
+                                                               'stale': stale, 'vacated': sorted(vacated)})
+            self._planned.append(course_slug)
+        except OSError as e:
+            print(f"Warning: Could not save sync state for {course_slug}: {e}")
+        print("  Sync: " + ", ".join(f"{count} {name}" for name, count in counts.items()))
+        return scheduled
+
+    def commit(self, progress):
+        """Save fingerprints for planned courses once their downloads have finished.
+
+        Lessons that were scheduled but did not complete in this run are left
+        out, so the next sync treats them as new and retries them; a changed
+        lesson that failed keeps its old files and fingerprint instead.
+        """
+        for course_slug in self._planned:
+            planned = self._read(self._path(course_slug, pending=True))
+            if planned is None:
+                print(f"Warning: Could not read sync state for {course_slug}")
+                continue
+            lessons = planned['lessons']
+            kept_dirs = set()
+            for lesson_id, entry in planned['scheduled'].items():
+                old = planned['stale'].get(lesson_id)
+                if (course_slug, entry['module'], lesson_id) in progress.completed_this_run:
+                    lessons[lesson_id] = entry
+                    if old:
+                        # Same path: only the set-aside copy is left to delete
+                        self._remove_outputs(old['path'], set_aside=old['path'] == entry['path'])
+                elif old:
+                    self._restore(old['path'])
+                    lessons[lesson_id] = old
+                    kept_dirs.add(os.path.dirname(old['path']))
+            for directory in planned['vacated']:
+                if directory not in kept_dirs:
+                    self.manifest.remove_dir(directory)
+            try:
+                self._save(self._path(course_slug), {'updated': datetime.utcnow().isoformat() + "Z",
+                                                     'lessons': lessons})
+                os.remove(self._path(course_slug, pending=True))
+            except OSError as e:
+                print(f"Warning: Could not save sync state for {course_slug}: {e}")
+        self._planned.clear()
+
 
 class KodeKloudDownloader:
+    # Built on first use: --list only needs the session and the HTTP cache, and
+    # must not load the manifest and progress store or start prefetch threads
+    assets = _LazyAttribute(lambda self: AssetStore())
+    manifest = _LazyAttribute(lambda self: OutputManifest())
+    progress = _LazyAttribute(lambda self: ProgressStore(PROGRESS_FILE, PROGRESS_JOURNAL_FILE))
+    # Separate lanes so slow video consumption cannot use up the text lookahead
+    prefetch = _LazyAttribute(lambda self: {kind: LessonPrefetcher(self._fetch_lesson) for kind in ('video', 'text')})
+
     def __init__(self, cookie_file):
         self.cookie_file = cookie_file
         self.session = requests.Session()
+        # Size the connection pool so every scheduler worker can keep its own connection alive
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.metrics = Metrics()
+        # Transport used for API calls and file downloads; use_async_http() swaps the inner one
+        self.http = RetryingTransport(self.session, self.metrics)
+        self.failed_lessons = []
+        self._failed_lock = threading.Lock()
+        self.cache = HTTPCache(metrics=self.metrics)
+        self.chunk_size = DOWNLOAD_CHUNK_SIZE
+        # Video variants to save; the first is saved as <title>.mkv, others as <title>.<quality>.mkv
+        self.video_qualities = [VIDEO_QUALITY]
+        self._asset_pool = ThreadPoolExecutor(max_workers=ASSET_WORKERS, thread_name_prefix='asset')
+        self.converter = None  # ConversionPool when --convert-workers is set
+        self.disk = DiskSpaceGuard()
+        self.videos = VideoOrchestrator(disk=self.disk)
+        self.video_client = VideoClient(cookie_file)
         self.token = None
-        self.progress = self._load_progress()
+        self._path_locks = KeyedLocks()
         
         if self.cookie_file and os.path.exists(self.cookie_file):
              self.token = self._load_cookies()
@@ -77,106 +1834,177 @@ class KodeKloudDownloader:
             
         return session_token
 
-    def _load_progress(self):
-        """Load download progress from JSON file."""
-        if os.path.exists(PROGRESS_FILE):
-            try:
-                with open(PROGRESS_FILE, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Warning: Could not load progress file: {e}")
-        return {"last_updated": None, "courses": {}}
-    
-    def _save_progress(self):
-        """Save download progress to JSON file."""
-        try:
-            self.progress["last_updated"] = datetime.utcnow().isoformat() + "Z"
-            with open(PROGRESS_FILE, 'w') as f:
-                json.dump(self.progress, f, indent=2)
-        except Exception as e:
-            print(f"Warning: Could not save progress: {e}")
-    
     def _is_lesson_completed(self, course_slug, module_id, lesson_id):
         """Check if a lesson has been completed."""
-        course_data = self.progress.get("courses", {}).get(course_slug, {})
-        completed_lessons = course_data.get("completed_lessons", {}).get(str(module_id), [])
-        return str(lesson_id) in completed_lessons
+        return self.progress.is_completed(course_slug, module_id, lesson_id)
     
     def _mark_lesson_completed(self, course_slug, course_title, module_id, lesson_id):
         """Mark a lesson as completed in progress tracking."""
-        if "courses" not in self.progress:
-            self.progress["courses"] = {}
-        
-        if course_slug not in self.progress["courses"]:
-            self.progress["courses"][course_slug] = {
-                "title": course_title,
-                "completed_modules": [],
-                "completed_lessons": {}
-            }
-        
-        course_data = self.progress["courses"][course_slug]
-        module_id_str = str(module_id)
-        
-        if module_id_str not in course_data["completed_lessons"]:
-            course_data["completed_lessons"][module_id_str] = []
-        
-        if str(lesson_id) not in course_data["completed_lessons"][module_id_str]:
-            course_data["completed_lessons"][module_id_str].append(str(lesson_id))
-        
-        self._save_progress()
+        self.progress.mark_completed(course_slug, course_title, module_id, lesson_id)
+
+    def use_async_http(self):
+        """Route API calls and file downloads through the asyncio backend."""
+        if aiohttp is None:
+            print("Warning: aiohttp is not installed; using the default HTTP backend.")
+            return False
+        self.http.transport = AsyncHTTPEngine(self.session)
+        return True
+
+    def _get_json_cached(self, url):
+        """GET a JSON API resource through the on-disk cache. Returns (status_code, data)."""
+        # Catalog contents depend on the account, so keep entries per token
+        return self.cache.fetch(self.http, url, vary=self.session.headers.get('Authorization', ''))
+
+    def close(self):
+        """Flush progress to disk and release network resources."""
+        # Only what was actually used was built
+        built = self.__dict__
+        for prefetcher in built.get('prefetch', {}).values():
+            prefetcher.close()
+        self._asset_pool.shutdown()
+        if self.converter:
+            self.converter.close()
+        self.video_client.close()
+        for name in ('progress', 'assets', 'manifest'):
+            if name in built:
+                built[name].close()
+        if self.http.transport is not self.session:
+            self.http.close()
 
     def sanitize_filename(self, name):
-        return re.sub(r'[\\/*?:"<>|]', "", name).strip()
-
-    def get_all_courses(self):
-        """Fetches all courses from the public API."""
-        print("Fetching course list...")
-        courses = []
-        page = 1
-        limit = 50
-        
-        while True:
-            try:
-                url = f"{API_BASE}/courses?page={page}&limit={limit}"
-                response = self.session.get(url)
-                if response.status_code != 200:
-                    print(f"Failed to fetch courses page {page} (Status: {response.status_code})")
-                    break
-                
-                data = response.json()
-                page_courses = data.get('courses', [])
-                if not page_courses:
-                    break
-                
-                courses.extend(page_courses)
-                
-                metadata = data.get('metadata', {})
-                if not metadata.get('next_page'):
+        return sanitize_filename(name)
+
+    def _fetch_courses_page(self, page, limit):
+        """Fetches one page of the course catalog, or None on failure."""
+        try:
+            url = f"{API_BASE}/courses?page={page}&limit={limit}"
+            status, data = self._get_json_cached(url)
+            if status != 200:
+                print(f"Failed to fetch courses page {page} (Status: {status})")
+                return None
+            return data
+        except Exception as e:
+            print(f"Error fetching courses page {page}: {e}")
+            return None
+
+    @staticmethod
+    def _total_pages(metadata, limit):
+        """Works out the catalog page count from page metadata, if it is reported.
+
+        Field names vary ('count' may be the size of this page only), so a
+        count is only trusted when it agrees with next_page: more than one
+        page if there is a next page, exactly one if next_page is null.
+        """
+        total_pages = None
+        for key in ('total_pages', 'last_page', 'pages'):
+            if isinstance(metadata.get(key), int):
+                total_pages = metadata[key]
+                break
+        else:
+            for key in ('total_count', 'total', 'count'):
+                if isinstance(metadata.get(key), int):
+                    total_pages = -(-metadata[key] // limit)
                     break
-                page = metadata['next_page']
-                
-            except Exception as e:
-                print(f"Error fetching courses: {e}")
+        if total_pages is None or 'next_page' not in metadata:
+            return total_pages
+        if metadata['next_page']:
+            return total_pages if total_pages >= 2 else None
+        return 1
+
+    def _follow_next_pages(self, data, page_size):
+        """Yields courses from the pages after data by following next_page links one by one."""
+        page = data.get('metadata', {}).get('next_page')
+        while page and data.get('courses'):
+            data = self._fetch_courses_page(page, page_size)
+            if not data:
                 break
-                
-        return courses
+            yield from data.get('courses', [])
+            page = data.get('metadata', {}).get('next_page')
+
+    def iter_courses(self, page_size=COURSES_PAGE_SIZE):
+        """Yields all courses from the public API in catalog order.
+
+        The first page reports the catalog size; the remaining pages are then
+        fetched concurrently, at most CATALOG_WORKERS ahead of the consumer.
+        If the reported size does not match the next_page links, pages are
+        walked one by one instead.
+        """
+        data = self._fetch_courses_page(1, page_size)
+        if not data:
+            return
+        yield from data.get('courses', [])
+        total_pages = self._total_pages(data.get('metadata', {}), page_size)
+
+        if total_pages is None:
+            # No usable page count: follow next_page links one by one
+            yield from self._follow_next_pages(data, page_size)
+            return
+
+        pages = bounded_map(lambda page: self._fetch_courses_page(page, page_size),
+                            range(2, total_pages + 1), CATALOG_WORKERS)
+        for data in pages:
+            if data:
+                yield from data.get('courses', [])
+        if total_pages > 1 and data:
+            # The count was low (e.g. it excluded some courses): pick up whatever follows the last page
+            yield from self._follow_next_pages(data, page_size)
+
+    def get_all_courses(self, page_size=COURSES_PAGE_SIZE):
+        """Fetches all courses from the public API as a list."""
+        return list(self.iter_courses(page_size))
 
     def get_course_details(self, slug):
         """Fetches detailed course structure including modules and lessons."""
         print(f"Fetching details for: {slug}...")
         try:
             url = f"{API_BASE}/courses/{slug}"
-            response = self.session.get(url)
-            if response.status_code != 200:
-                print(f"Failed to fetch course details (Status: {response.status_code})")
+            status, data = self._get_json_cached(url)
+            if status != 200:
+                print(f"Failed to fetch course details (Status: {status})")
                 return None
-            return response.json()
+            return data
         except Exception as e:
             print(f"Error fetching course details: {e}")
             return None
 
+    def _fetch_lesson(self, lesson_id, course_id):
+        """Fetches a lesson payload (content, video_url). Returns (status_code, data)."""
+        url = f"{API_BASE}/lessons/{lesson_id}?course_id={course_id}"
+        with self.metrics.timer('api') as sample:
+            response = self.http.get(url)
+            sample['error'] = response.status_code != 200
+            sample['bytes'] = len(response.content)
+        if response.status_code != 200:
+            return response.status_code, None
+        return 200, response.json()
+
+    def video_suffixes(self):
+        """File suffixes of the video variants, in video_qualities order."""
+        return ['.mkv'] + [f'.{quality}.mkv' for quality in self.video_qualities[1:]]
+
+    def lesson_output_exists(self, lesson, output_dir):
+        """Check whether a lesson's .md file, or all its video variants, are already downloaded."""
+        base = os.path.join(output_dir, self.sanitize_filename(lesson.get('title', 'Unknown Lesson')))
+        if lesson_kind(lesson) != 'video':
+            return self.manifest.has(base + '.md')
+        return all(self.manifest.has(base + suffix) for suffix in self.video_suffixes())
+
+    def _lesson_failed(self, lesson, course_slug, reason):
+        """Report a lesson that could not be downloaded and remember it for the summary."""
+        print(f"  {reason}")
+        self.metrics.count('lessons_failed')
+        with self._failed_lock:
+            self.failed_lessons.append((course_slug, lesson.get('title', 'Unknown Lesson'), reason))
+
     def download_lesson(self, lesson, course_slug, course_title, module_id, output_dir, course_id):
         """Downloads a single lesson content using API and converting to Markdown."""
+        base = os.path.join(output_dir, self.sanitize_filename(lesson.get('title', 'Unknown Lesson')))
+        # Lessons sharing a title in one module write the same files. Hold the output
+        # path while checking and writing, so the second one is skipped as in a serial run.
+        with self._lock_for_path(base + ('.mkv' if lesson_kind(lesson) == 'video' else '.md')):
+            self._download_lesson(lesson, course_slug, course_title, module_id, output_dir, course_id)
+
+    def _download_lesson(self, lesson, course_slug, course_title, module_id, output_dir, course_id):
         lesson_title = lesson.get('title', 'Unknown Lesson')
         lesson_id = lesson.get('id')
         lesson_type = lesson.get('type')
@@ -189,23 +2017,17 @@ class KodeKloudDownloader:
         safe_lesson_title = self.sanitize_filename(lesson_title)
         md_filename = f"{safe_lesson_title}.md"
         md_path = os.path.join(target_dir, md_filename)
-        video_path = os.path.join(target_dir, f"{safe_lesson_title}.mkv")
+        kind = lesson_kind(lesson)
         
         # Check if file already exists on disk (primary check)
         # For video lessons, check for .mkv file; for others, check for .md file
-        file_exists = False
-        if lesson_type == 'video' and DOWNLOAD_VIDEOS:
-            file_exists = os.path.exists(video_path)
-            file_type = "video"
-        else:
-            file_exists = os.path.exists(md_path)
-            file_type = "file"
-        
-        if file_exists:
+        if self.lesson_output_exists(lesson, output_dir):
+            file_type = "video" if kind == 'video' else "file"
             print(f"  Skipping ({file_type} exists): {lesson_title}")
-            # Mark as completed if not already marked
-            if not self._is_lesson_completed(course_slug, module_id, lesson_id):
-                self._mark_lesson_completed(course_slug, course_title, module_id, lesson_id)
+            self.prefetch[kind].discard(lesson_id, course_id)
+            self.metrics.count('lessons_skipped')
+            # Mark as completed (a no-op if already recorded)
+            self._mark_lesson_completed(course_slug, course_title, module_id, lesson_id)
             return
         
         # If file doesn't exist but marked as completed in progress, re-download it
@@ -213,17 +2035,15 @@ class KodeKloudDownloader:
             print(f"  Re-downloading (file missing): {lesson_title}")
 
         # Handle video lessons
-        if lesson_type == 'video' and DOWNLOAD_VIDEOS:
+        if kind == 'video':
             try:
-                # Fetch video URL from API
-                url = f"{API_BASE}/lessons/{lesson_id}?course_id={course_id}"
-                response = self.session.get(url)
+                # Video URL from the API (usually already prefetched)
+                status, data = self.prefetch[kind].get(lesson_id, course_id)
                 
-                if response.status_code != 200:
-                    print(f"  Failed to fetch video data (Status: {response.status_code})")
+                if status != 200:
+                    self._lesson_failed(lesson, course_slug, f"Failed to fetch video data (Status: {status})")
                     return
                 
-                data = response.json()
                 video_url = data.get('video_url')
                 
                 if video_url:
@@ -233,139 +2053,62 @@ class KodeKloudDownloader:
                     
                     # Download video with subtitles
                     video_path = os.path.join(target_dir, safe_lesson_title)
-                    success = self.download_video_with_subtitles(player_url, video_path, VIDEO_QUALITY)
+                    success = self.download_video_with_subtitles(player_url, video_path, self.video_qualities)
                     
                     if success:
+                        self.metrics.count('lessons_downloaded')
                         # Mark as completed
                         self._mark_lesson_completed(course_slug, course_title, module_id, lesson_id)
+                    else:
+                        self._lesson_failed(lesson, course_slug, f"Video download failed: {lesson_title}")
                     return
                 else:
-                    print(f"  No video URL found for: {lesson_title}")
+                    self._lesson_failed(lesson, course_slug, f"No video URL found for: {lesson_title}")
                     return
+            except InsufficientDiskSpace:
+                raise
             except Exception as e:
-                print(f"  Error processing video lesson: {e}")
+                self._lesson_failed(lesson, course_slug, f"Error processing video lesson: {e}")
                 return
         
         print(f"  Downloading: {lesson_title} ({lesson_type})")
 
         try:
-             # Fetch from API
-            url = f"{API_BASE}/lessons/{lesson_id}?course_id={course_id}"
-            response = self.session.get(url)
+            # Lesson payload from the API (usually already prefetched)
+            status, data = self.prefetch[kind].get(lesson_id, course_id)
             
-            if response.status_code != 200:
-                print(f"  Failed to fetch lesson data (Status: {response.status_code})")
+            if status != 200:
+                self._lesson_failed(lesson, course_slug, f"Failed to fetch lesson data (Status: {status})")
                 return
 
-            data = response.json()
             content_raw = data.get('content', '')
-            video_url = data.get('video_url')
             
             if content_raw:
-                # Detect if content is HTML
-                is_html = bool(BeautifulSoup(content_raw, "html.parser").find())
-                
-                if is_html:
-                    markdown_content = md(content_raw, heading_style="ATX")
-                    soup = BeautifulSoup(content_raw, 'html.parser')
-                    # Download HTML Images
-                    images = soup.find_all('img')
-                    image_map = {}
-                    
-                    for img in images:
-                        src = img.get('src')
-                        if src:
-                            if not src.startswith('http'):
-                                src = urljoin(BASE_URL, src)
-                            
-                            img_name = self.sanitize_filename(os.path.basename(unquote(src.split('?')[0])))
-                            if img_name in image_map.values():
-                                 base, ext = os.path.splitext(img_name)
-                                 img_name = f"{base}_{len(image_map)}{ext}"
-
-                            self._download_file(src, os.path.join(target_dir, img_name))
-                            image_map[src] = img_name
-                    
-                    final_content = markdown_content
-                else:
-                    # Already Markdown or Text
-                    final_content = content_raw
-
-                # Handle Markdown images (in both cases: either from original MD or leftover/converted)
-                md_image_pattern = re.compile(r'!\[(.*?)\]\((.*?)\)')
-                
-                def replace_image(match):
-                    alt_text = match.group(1)
-                    img_url = match.group(2)
-                    
-                    # Be careful with escaped characters if coming from markdownify
-                    # But if we skipped markdownify for MD input, it should be clean.
-                    # If markdownify ran, it might have escaped underscores in URLs.
-                    # We might need to unescape or handle it. 
-                    # For now, let's assume if it was HTML, the img tags were handled above?
-                    # markdownify converts <img> to ![](). 
-                    # If we downloaded via <img> tags, we still need to fix the link in the MD.
-                    # But markdownify doesn't know the local filename.
-                    
-                    # Better approach:
-                    # If HTML, we rely on markdownify's output and regex-replace it.
-                    # AND we must unescape the URL if markdownify escaped it.
-                    
-                    clean_url = img_url.replace(r'\_', '_').replace(r'\*', '*')
-                    
-                    if not clean_url.startswith('http'):
-                         # It might be a local path if markdownify kept it? 
-                         # Or absolute URL.
-                         if not clean_url.startswith('/') and '://' not in clean_url:
-                             # Relative?
-                             clean_url = urljoin(BASE_URL, clean_url)
-                    
-                    if not clean_url.startswith('http'):
-                        return match.group(0)
+                with self.metrics.timer('convert'):
+                    if self.converter:
+                        final_content, assets = self.converter.convert(content_raw)
+                    else:
+                        final_content, assets = convert_lesson_content(content_raw)
 
-                    img_name = self.sanitize_filename(os.path.basename(unquote(clean_url.split('?')[0])))
-                    self._download_file(clean_url, os.path.join(target_dir, img_name))
-                    
-                    return f'![{alt_text}]({img_name})'
-                
-                final_content = md_image_pattern.sub(replace_image, final_content)
+                # Fetch the lesson's images and PDFs as one concurrent batch before writing it
+                failed = self._download_assets(assets, target_dir)
+                if failed:
+                    print(f"  {len(failed)} of {len(assets)} assets failed for: {lesson_title}")
+                    final_content = mark_failed_assets(final_content, failed)
 
                 with open(md_path, 'w', encoding='utf-8') as f:
                     f.write(f"# {lesson_title}\n\n")
                     f.write(final_content)
+                self.manifest.add(md_path)
                 
+                self.metrics.count('lessons_downloaded')
                 # Mark lesson as completed
                 self._mark_lesson_completed(course_slug, course_title, module_id, lesson_id)
-                
-                # Download PDFs (from soup of original content if HTML)
-                if is_html:
-                    pdf_links = soup.find_all('a', href=re.compile(r'\.pdf$', re.I))
-                    for link in pdf_links:
-                        pdf_url = link['href']
-                        if not pdf_url.startswith('http'):
-                            pdf_url = urljoin(BASE_URL, pdf_url)
-                        
-                        pdf_name = os.path.basename(unquote(pdf_url))
-                        self._download_file(pdf_url, os.path.join(target_dir, pdf_name))
-                else:
-                    # Markdown PDF links: [text](url.pdf) or just url.pdf
-                    # Regex for [text](url.pdf)
-                    md_pdf_pattern = re.compile(r'\[.*?\]\((.*?\.pdf)\)', re.I)
-                    matches = md_pdf_pattern.findall(content_raw)
-                    for pdf_url in matches:
-                        if not pdf_url.startswith('http'):
-                            pdf_url = urljoin(BASE_URL, pdf_url)
-                        
-                        pdf_name = os.path.basename(unquote(pdf_url))
-                        self._download_file(pdf_url, os.path.join(target_dir, pdf_name))
-            
-            else:
-                 if lesson_type == 'video':
-                     # Create a file for the video URL
-                     pass
 
+        except InsufficientDiskSpace:
+            raise
         except Exception as e:
-            print(f"  Error processing lesson: {e}")
+            self._lesson_failed(lesson, course_slug, f"Error processing lesson: {e}")
 
     def get_course_id_from_details(self, slug):
         # We need to fetch it or store it. 
@@ -374,56 +2117,136 @@ class KodeKloudDownloader:
         # I'll update the signature to accept course_id
         return None
 
+    def _lock_for_path(self, path):
+        """Hold a lock shared by every worker writing to the same path."""
+        return self._path_locks.hold(os.path.abspath(path))
+
+    def _download_assets(self, assets, target_dir):
+        """Download a lesson's (url, filename) assets concurrently; returns the ones that failed."""
+        results = self._asset_pool.map(
+            lambda asset: self._download_file(asset[0], os.path.join(target_dir, asset[1])), assets)
+        return [asset for asset, ok in zip(assets, results) if not ok]
+
     def _download_file(self, url, path):
-        if os.path.exists(path):
-            print(f"    Skipping (exists): {os.path.basename(path)}")
-            return 
-            
-        print(f"  Downloading: {os.path.basename(path)}")
-        try:
-            with self.session.get(url, stream=True) as r:
-                r.raise_for_status()
-                total_size = int(r.headers.get('content-length', 0))
-                with open(path, 'wb') as f, tqdm(
-                    total=total_size, unit='iB', unit_scale=True, unit_divisor=1024, leave=False
-                ) as bar:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        size = f.write(chunk)
-                        bar.update(size)
-        except Exception as e:
-             print(f"  Failed to download file: {e}")
+        """Download url to path through the asset store; returns True on success."""
+        # Lessons in the same module often embed the same image; let one worker fetch it
+        with self._lock_for_path(path):
+            if self.manifest.has(path):
+                print(f"    Skipping (exists): {os.path.basename(path)}")
+                return True
+            if not self.assets.fetch(url, path, self._stream_to_file):
+                return False
+            self.manifest.add(path)
+            return True
+
+    def _stream_to_file(self, url, path):
+        """Download url into the partial file path and return the SHA-256 of its content.
+
+        An existing partial file is resumed with an HTTP Range request, also
+        after a connection drop mid-transfer. The result is checked against
+        the expected length and any checksum the server sends. On failure the
+        partial file is kept so the next attempt can resume it.
+        """
+        for attempt in range(1, DOWNLOAD_RESUME_ATTEMPTS + 1):
+            offset = os.path.getsize(path) if os.path.exists(path) else 0
+            try:
+                with self.metrics.timer('asset') as sample:
+                    digest = self._stream_range(url, path, offset)
+                    sample['bytes'] = os.path.getsize(path) - offset
+                return digest
+            except PERMANENT_ERRORS:
+                raise
+            except RESUMABLE_ERRORS as e:
+                if attempt == DOWNLOAD_RESUME_ATTEMPTS:
+                    raise
+                self.metrics.count('asset_resumes')
+                print(f"    Resuming download after error: {e}")
+            except InsufficientDiskSpace:
+                raise
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    # The disk filled up anyway (e.g. no Content-Length); retrying cannot help
+                    raise InsufficientDiskSpace(0, self.disk.available()) from e
+                raise
+
+    def _stream_range(self, url, path, offset):
+        headers = {'Range': f'bytes={offset}-'} if offset else None
+        with self.http.get(url, stream=True, headers=headers) as r:
+            if r.status_code == 416:
+                # Stale partial file larger than the resource; start over
+                os.remove(path)
+                return self._stream_range(url, path, 0)
+            r.raise_for_status()
+
+            digest = hashlib.sha256()
+            if r.status_code == 206:
+                expected = int(r.headers.get('content-range', '').rpartition('/')[2] or 0)
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                        digest.update(chunk)
+                mode = 'ab'
+            else:
+                # Full response (server ignored the Range header or nothing to resume)
+                expected = int(r.headers.get('content-length', 0))
+                offset = 0
+                mode = 'wb'
+            md5 = hashlib.md5() if r.status_code == 200 and r.headers.get('content-md5') else None
+
+            # 206 bodies and Content-Length are the bytes still to be written
+            remaining = int(r.headers.get('content-length', 0))
+            with self.disk.reserve(remaining), open(path, mode) as f, tqdm.tqdm(
+                total=expected or None, initial=offset, unit='iB', unit_scale=True, unit_divisor=1024, leave=False
+            ) as bar:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    digest.update(chunk)
+                    if md5:
+                        md5.update(chunk)
+                    size = f.write(chunk)
+                    bar.update(size)
+
+            received = os.path.getsize(path)
+            if expected and received != expected:
+                raise requests.ConnectionError(f"incomplete download: {received} of {expected} bytes")
+            self._verify_checksum(r.headers, digest, md5, path)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _verify_checksum(headers, sha256, md5, path):
+        """Check the finished file against Content-MD5 or a sha-256 Digest header, if sent."""
+        expected = {}
+        if md5:
+            expected[md5] = headers.get('content-md5')
+        for field in (headers.get('digest') or '').split(','):
+            algorithm, _, value = field.strip().partition('=')
+            if algorithm.lower() == 'sha-256':
+                expected[sha256] = value
+        for digest, value in expected.items():
+            if base64.b64encode(digest.digest()).decode() != value.strip():
+                os.remove(path)
+                raise ValueError(f"checksum mismatch for {os.path.basename(path)}")
     
-    def download_video_with_subtitles(self, video_url, output_path, quality='1080p'):
-        """Download video with subtitles using yt-dlp."""
-        if os.path.exists(f"{output_path}.mkv"):
+    def download_video_with_subtitles(self, video_url, output_path, qualities=(VIDEO_QUALITY,)):
+        """Download video with subtitles using yt-dlp, one .mkv per requested quality."""
+        suffixes = ['.mkv'] + [f'.{quality}.mkv' for quality in qualities[1:]]
+        # Only fetch the variants that are not on disk yet
+        variants = {quality: output_path + suffix[:-len('.mkv')] for quality, suffix in zip(qualities, suffixes)
+                    if not self.manifest.has(output_path + suffix)}
+        if not variants:
             print(f"    Skipping (video exists): {os.path.basename(output_path)}.mkv")
             return True
         
-        print(f"  Downloading video: {os.path.basename(output_path)}")
-        
-        headers = {
-            'Referer': 'https://learn.kodekloud.com/',
-        }
-        
-        ydl_opts = {
-            # Try 1080p first, fallback to 720p, then best available
-            'format': 'bestvideo[height<=1080]+bestaudio/bestvideo[height<=720]+bestaudio/best',
-            'concurrent_fragment_downloads': 15,
-            'outtmpl': f'{output_path}.%(ext)s',
-            'cookiefile': self.cookie_file,
-            'merge_output_format': 'mkv',
-            'writesubtitles': True,
-            'writeautomaticsub': True,
-            'subtitleslangs': ['en'],
-            'http_headers': headers,
-            'quiet': True,
-            'no_warnings': True,
-        }
+        print(f"  Downloading video: {os.path.basename(output_path)} ({', '.join(variants)})")
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([video_url])
+            with self.metrics.timer('video') as sample:
+                self.video_client.download(video_url, output_path, self.videos, variants)
+                for path in variants.values():
+                    if os.path.exists(f"{path}.mkv"):
+                        sample['bytes'] = sample.get('bytes', 0) + os.path.getsize(f"{path}.mkv")
+                        self.manifest.add(f"{path}.mkv")
             return True
+        except InsufficientDiskSpace:
+            raise
         except yt_dlp.utils.DownloadError as e:
             print(f"  Failed to download video: {e}")
             return False
@@ -432,6 +2255,331 @@ class KodeKloudDownloader:
             return False
 
 
+class LessonQueue(queue.PriorityQueue):
+    """Bounded priority queue of lessons whose ordering can be recomputed while items wait.
+
+    Items are [key, seq, job, meta]; reorder() recomputes every waiting
+    item's key from its meta, so a policy or priority change applies to
+    lessons that are already queued.
+    """
+
+    def reorder(self, key):
+        with self.mutex:
+            for item in self.queue:
+                if item[2] is not None:
+                    item[0] = key(item[3])
+            heapq.heapify(self.queue)
+
+    def peek(self, n):
+        """Return the next n waiting jobs in the order get() will return them."""
+        with self.mutex:
+            return [item[2] for item in heapq.nsmallest(n, self.queue) if item[2] is not None]
+
+
+class DownloadScheduler:
+    """Fans lessons out to bounded worker pools, one for videos and one for text/assets.
+
+    Lessons from any module or course can be queued; a slow video download only
+    occupies a video worker, so Markdown lessons queued behind it keep flowing.
+    Lessons refused for lack of disk space are set aside while the remaining
+    (often smaller) lessons keep running, then retried smallest first at the end.
+
+    Waiting lessons run in an order set by a policy, after explicit per-course
+    priorities (higher first):
+
+        fifo         catalog order
+        sjf          smallest course (estimated bytes still to download) first
+        round-robin  one lesson from each course in turn
+        text-first   catalog order, and no new video starts while text lessons wait
+
+    A control file (JSON: {"policy": ..., "priorities": {slug: n}}) is re-read
+    whenever it changes, and the new order applies to lessons already queued.
+    """
+
+    def __init__(self, downloader, video_workers=VIDEO_WORKERS, text_workers=TEXT_WORKERS,
+                 queue_limit=SCHEDULER_QUEUE_LIMIT, policy='fifo', priorities=None, control_file=None):
+        self.downloader = downloader
+        self.policy = policy
+        self.priorities = dict(priorities or {})
+        self.control_file = control_file
+        self._control_mtime = None
+        self._control_checked = 0
+        self._control_lock = threading.Lock()
+        self._seq = itertools.count()
+        self._turns = collections.Counter()
+        self.queues = {kind: LessonQueue(maxsize=queue_limit) for kind in ('video', 'text')}
+        for kind, jobs in self.queues.items():
+            # Prefetch payloads in the order workers will dequeue them, not the order they were queued
+            downloader.prefetch[kind].order = \
+                lambda n, jobs=jobs: [(job[0].get('id'), job[5]) for job in jobs.peek(n)]
+        self._check_control()
+        self.workers = []
+        for kind, count in (('video', video_workers), ('text', text_workers)):
+            for i in range(max(1, count)):
+                worker = threading.Thread(target=self._run_worker, args=(kind,),
+                                          name=f"{kind}-worker-{i+1}", daemon=True)
+                worker.start()
+                self.workers.append((kind, worker))
+        self.deferred = []
+        self._deferred_lock = threading.Lock()
+
+    def _key(self, meta):
+        priority = -self.priorities.get(meta['course'], 0)
+        if self.policy == 'sjf':
+            return (priority, meta['course_bytes'], meta['seq'])
+        if self.policy == 'round-robin':
+            return (priority, meta['turn'], meta['seq'])
+        return (priority, meta['seq'])
+
+    def _check_control(self):
+        """Apply the control file's policy and priorities if it changed since the last check."""
+        if not self.control_file or time.time() - self._control_checked < CONTROL_POLL_INTERVAL:
+            return
+        with self._control_lock:
+            self._control_checked = time.time()
+            try:
+                mtime = os.path.getmtime(self.control_file)
+                if mtime == self._control_mtime:
+                    return
+                self._control_mtime = mtime
+                with open(self.control_file, 'r', encoding='utf-8') as f:
+                    control = json.load(f)
+            except FileNotFoundError:
+                return
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not read control file: {e}")
+                return
+            if not isinstance(control, dict):
+                print("Warning: Control file must contain a JSON object")
+                return
+            if control.get('policy') in SCHEDULING_POLICIES:
+                self.policy = control['policy']
+            elif 'policy' in control:
+                print(f"Warning: Unknown scheduling policy in control file: {control['policy']}")
+            if 'priorities' in control:
+                try:
+                    self.priorities = {str(slug): int(n) for slug, n in control['priorities'].items()}
+                except (TypeError, ValueError, AttributeError) as e:
+                    print(f"Warning: Invalid priorities in control file: {e}")
+            for jobs in self.queues.values():
+                jobs.reorder(self._key)
+
+    def submit(self, lesson, course_slug, course_title, module_id, output_dir, course_id, course_bytes=0):
+        """Queue a lesson for download; waits only while that kind's queue is full.
+
+        course_bytes is the estimated size of the course's pending lessons, used by the sjf policy.
+        """
+        kind = lesson_kind(lesson)
+        if not self.downloader.lesson_output_exists(lesson, output_dir):
+            self.downloader.prefetch[kind].schedule(lesson.get('id'), course_id)
+        meta = {'course': course_slug, 'course_bytes': course_bytes, 'seq': next(self._seq),
+                'turn': self._turns[course_slug]}
+        self._turns[course_slug] += 1
+        job = (lesson, course_slug, course_title, module_id, output_dir, course_id)
+        self.queues[kind].put([self._key(meta), meta['seq'], job, meta])
+
+    def _next(self, kind):
+        """Take the next job for a worker of the given kind, honouring text-first."""
+        self._check_control()
+        while kind == 'video' and self.policy == 'text-first' and self.queues['text'].qsize():
+            time.sleep(0.2)
+            self._check_control()
+        return self.queues[kind].get()[2]
+
+    def _run_worker(self, kind):
+        jobs = self.queues[kind]
+        while True:
+            try:
+                job = self._next(kind)
+            except Exception as e:
+                # Nothing was taken from the queue, so there is no task_done to balance
+                print(f"  Error in {kind} worker: {e}")
+                continue
+            try:
+                if job is None:
+                    return
+                start = time.time()
+                self.downloader.download_lesson(*job)
+                self.downloader.metrics.course_span(job[1], start, time.time())
+            except InsufficientDiskSpace as e:
+                print(f"  Deferring {job[0].get('title', 'Unknown Lesson')}: {e}")
+                self.downloader.metrics.count('lessons_deferred')
+                with self._deferred_lock:
+                    self.deferred.append((e.size, job))
+            except Exception as e:
+                print(f"  Error in {kind} worker: {e}")
+            finally:
+                jobs.task_done()
+
+    def join(self):
+        """Wait for all queued lessons to finish and stop the workers."""
+        for kind, _ in self.workers:
+            # Sentinels sort after every lesson
+            self.queues[kind].put([(float('inf'),), next(self._seq), None, None])
+        for _, worker in self.workers:
+            worker.join()
+        # Space may have been over-reserved or freed meanwhile; give deferred lessons one more try
+        for _, job in sorted(self.deferred, key=lambda item: item[0]):
+            try:
+                self.downloader.download_lesson(*job)
+            except InsufficientDiskSpace as e:
+                self.downloader._lesson_failed(job[0], job[1], str(e))
+            except Exception as e:
+                print(f"  Error retrying deferred lesson: {e}")
+        self.deferred.clear()
+
+    def cancel(self):
+        """Drop lessons that have not started yet."""
+        for jobs in self.queues.values():
+            while True:
+                try:
+                    jobs.get_nowait()
+                    jobs.task_done()
+                except queue.Empty:
+                    break
+
+
+def bounded_map(fn, items, workers):
+    """Like ThreadPoolExecutor.map, but consumes items lazily with at most `workers` calls in flight."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def lesson_kind(lesson):
+    """Classify a lesson as 'video' or 'text' for scheduling."""
+    return 'video' if lesson.get('type') == 'video' and DOWNLOAD_VIDEOS else 'text'
+
+
+def estimate_lesson_bytes(lesson, quality=VIDEO_QUALITY):
+    """Rough output size of a lesson, from its duration when the API provides one."""
+    if lesson_kind(lesson) == 'text':
+        return ESTIMATED_TEXT_LESSON_BYTES
+    seconds = lesson.get('duration')
+    if not isinstance(seconds, (int, float)) or seconds <= 0:
+        seconds = ESTIMATED_VIDEO_SECONDS
+    height = int(str(quality).lower().rstrip('p'))
+    return int(seconds * ESTIMATED_VIDEO_BYTES_PER_SEC * (height / 1080) ** 2)
+
+
+def estimate_video_bytes(info, quality=VIDEO_QUALITY):
+    """Expected download size of extracted video info, from the selected formats' filesize or bitrate."""
+    total = 0
+    for f in info.get('requested_formats') or [info]:
+        size = f.get('filesize') or f.get('filesize_approx')
+        if not size and f.get('tbr') and info.get('duration'):
+            size = f['tbr'] * 1000 / 8 * info['duration']
+        total += size or 0
+    return int(total) or estimate_lesson_bytes({'type': 'video', 'duration': info.get('duration')}, quality)
+
+
+def video_format(quality):
+    """yt-dlp format selector for a quality such as '720p': best video up to that height, else best."""
+    height = int(str(quality).lower().rstrip('p'))
+    return f'bestvideo[height<={height}]+bestaudio/best[height<={height}]/best'
+
+
+def sanitize_filename(name):
+    return re.sub(r'[\\/*?:"<>|]', "", name).strip()
+
+
+_HTML_TAG_RE = re.compile(r'<[a-zA-Z][^>]*>')
+_MD_LINK_RE = re.compile(r'(!?)\[(.*?)\]\((.*?)\)')
+_PDF_RE = re.compile(r'\.pdf$', re.I)
+
+
+class _AssetNames:
+    """Assigns each asset URL in a lesson a unique local filename."""
+
+    def __init__(self):
+        self.by_url = {}
+        self.taken = set()
+
+    def local_name(self, url):
+        """Return the local filename for url, or None if it is not downloadable."""
+        if not url.startswith('http'):
+            url = urljoin(BASE_URL, url)
+        if not url.startswith('http'):
+            return None  # data: URIs, mailto: links, ...
+        if url in self.by_url:
+            return self.by_url[url]
+        name = sanitize_filename(os.path.basename(unquote(url.split('?')[0])))
+        if not name:
+            return None
+        if name in self.taken:
+            base, ext = os.path.splitext(name)
+            name = f"{base}_{len(self.by_url)}{ext}"
+        self.by_url[url] = name
+        self.taken.add(name)
+        return name
+
+    def assets(self):
+        return list(self.by_url.items())
+
+
+def convert_lesson_content(content_raw):
+    """Convert a lesson's raw content to Markdown in one pass.
+
+    Image and PDF references are rewritten to local filenames (URL-quoted, so
+    names with spaces stay valid Markdown links), whether they are HTML tags
+    or Markdown links mixed into the HTML. Returns the Markdown and the list
+    of (url, filename) assets it refers to.
+    """
+    names = _AssetNames()
+
+    # Markdown ![alt](img) and [text](file.pdf) links, in raw Markdown or left as text inside HTML
+    def replace_link(match):
+        bang, text, target = match.groups()
+        clean_url = target.replace(r'\_', '_').replace(r'\*', '*')
+        if unquote(clean_url) in names.taken:
+            return match.group(0)  # Already rewritten from an <img> or <a> tag
+        if not bang and not _PDF_RE.search(clean_url):
+            return match.group(0)
+        local = names.local_name(clean_url)
+        if not local:
+            return match.group(0)
+        return f'{bang}[{text}]({quote(local)})'
+
+    if _HTML_TAG_RE.search(content_raw):
+        # Parse once; rewrite references on the tree, then convert that same tree
+        soup = bs4.BeautifulSoup(content_raw, 'html.parser')
+        for img in soup.find_all('img', src=True):
+            local = names.local_name(img['src'])
+            if local:
+                img['src'] = quote(local)
+        for link in soup.find_all('a', href=_PDF_RE):
+            local = names.local_name(link['href'])
+            if local:
+                link['href'] = quote(local)
+        content_raw = markdownify.MarkdownConverter(heading_style="ATX").convert_soup(soup)
+
+    return _MD_LINK_RE.sub(replace_link, content_raw), names.assets()
+
+
+def convert_batch(contents):
+    """Convert several lessons in one call (ConversionPool task). Returns [(ok, result or exception)]."""
+    results = []
+    for content_raw in contents:
+        try:
+            results.append((True, convert_lesson_content(content_raw)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+def mark_failed_assets(markdown, failed):
+    """Point links to assets that failed to download back at their URL, with a visible marker."""
+    for url, name in failed:
+        markdown = markdown.replace(f"]({quote(name)})",
+                                    f"]({url}) <!-- kodekloud-dl: failed to download {name} -->")
+    return markdown
+
+
 def parse_selection_input(input_str, max_value):
     """Parse user input like '1-10, 15, 16-19' into a list of indices.
     
@@ -473,143 +2621,447 @@ def parse_selection_input(input_str, max_value):
         return None
 
 
+def parse_size(value):
+    """Parse a byte count such as '500K', '20M' or '2G' (binary units) into bytes."""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?', value.strip(), re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {value}")
+    return int(float(match.group(1)) * 1024 ** ' KMGT'.index(match.group(2).upper() or ' '))
+
+
+def parse_rate(value):
+    """Parse a byte rate such as '500K' or '20M' into bytes/sec."""
+    return parse_size(value)
+
+
+def parse_shard(value):
+    """Parse a shard spec 'i/N' (1 <= i <= N) into (i, N)."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard: {value} (expected i/N, e.g. 1/4)")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"invalid shard: {value} (i must be between 1 and N)")
+    return index, count
+
+
+def in_shard(course_slug, shard):
+    """Deterministically assign a course to one of N shards by hashing its slug."""
+    index, count = shard
+    return int(hashlib.sha1(course_slug.encode('utf-8')).hexdigest(), 16) % count == index - 1
+
+
+def course_matches(course, patterns):
+    """Check whether a course's slug or title matches any of the (case-insensitive) glob patterns."""
+    return any(fnmatch.fnmatchcase(course['slug'].lower(), p.lower()) or
+               fnmatch.fnmatchcase(course['title'].lower(), p.lower()) for p in patterns)
+
+
+def module_filter(patterns):
+    """Build a select_modules callback from module numbers/ranges ('1-3') or title glob patterns."""
+    def select_modules(modules):
+        selected = set()
+        for pattern in patterns:
+            if re.fullmatch(r'[\d\s,-]+', pattern):
+                selected.update(parse_selection_input(pattern, len(modules)) or [])
+            else:
+                selected.update(i for i, m in enumerate(modules)
+                                if fnmatch.fnmatchcase(m.get('title', '').lower(), pattern.lower()))
+        return [(i+1, modules[i]) for i in sorted(selected)]
+    return select_modules
+
+
+def parse_args(argv=None):
+    """Parse command line options; with no options the downloader runs interactively.
+
+    --config names a JSON file whose keys are option names (e.g. "video_workers");
+    options given on the command line take precedence over the file.
+    """
+    parser = argparse.ArgumentParser(description="Download KodeKloud courses as Markdown, PDFs and videos.")
+    parser.add_argument('--list', action='store_true', help="print the course catalog and exit")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="print what would be downloaded (lesson counts, estimated size) and exit")
+    parser.add_argument('--config', metavar='PATH',
+                        help="read options from a JSON file (keys are option names, e.g. \"video_workers\")")
+    parser.add_argument('--course', action='append', metavar='SLUG',
+                        help="download courses whose slug or title matches (glob patterns allowed, repeatable); "
+                             "runs without prompts")
+    parser.add_argument('--all', action='store_true', help="download every course without prompting")
+    parser.add_argument('--module', action='append', metavar='FILTER',
+                        help="only download modules by number or range ('1-3') or title pattern (repeatable)")
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N',
+                        help="only process courses assigned to shard I of N (split by slug hash)")
+    parser.add_argument('--cookies', metavar='PATH', default=COOKIES_FILE,
+                        help=f"cookie file to authenticate with (default: {COOKIES_FILE})")
+    parser.add_argument('--token', help="session token, instead of a cookie file (or set KODEKLOUD_TOKEN)")
+    parser.add_argument('--quality', default=VIDEO_QUALITY,
+                        help=f"maximum video height, e.g. 720p (default: {VIDEO_QUALITY}); several comma-separated "
+                             "qualities (1080p,480p) save one .mkv per quality, sharing audio and subtitles")
+    parser.add_argument('--policy', choices=SCHEDULING_POLICIES, default='fifo',
+                        help="order of queued lessons: fifo (catalog order), sjf (smallest course first), "
+                             "round-robin (across courses) or text-first (default: fifo)")
+    parser.add_argument('--priority', action='append', metavar='SLUG=N',
+                        help="run a course's lessons before lower-priority ones (default 0, higher first; repeatable)")
+    parser.add_argument('--control', metavar='PATH',
+                        help="JSON file with {\"policy\": ..., \"priorities\": {slug: n}}, re-read during the run")
+    parser.add_argument('--min-free', type=parse_size, default=DISK_MIN_FREE, metavar='SIZE',
+                        help="free space to keep on the download volume, e.g. 5G (default: 1G); "
+                             "lessons that would go below it are deferred or skipped")
+    parser.add_argument('--text-workers', type=int, default=TEXT_WORKERS,
+                        help=f"text lessons downloaded at the same time (default: {TEXT_WORKERS})")
+    parser.add_argument('--convert-workers', type=int, default=CONVERT_WORKERS,
+                        help="processes converting HTML to Markdown, e.g. the number of CPU cores "
+                             "(default: 0, convert in the text worker threads)")
+    parser.add_argument('--async-http', action='store_true',
+                        help="use the asyncio HTTP backend (requires aiohttp)")
+    parser.add_argument('--page-size', type=int, default=COURSES_PAGE_SIZE,
+                        help=f"courses per catalog page (default: {COURSES_PAGE_SIZE})")
+    parser.add_argument('--refresh', action='store_true',
+                        help="ignore cached catalog and course details and fetch them again")
+    parser.add_argument('--chunk-size', type=int, default=DOWNLOAD_CHUNK_SIZE,
+                        help=f"bytes per read when streaming files (default: {DOWNLOAD_CHUNK_SIZE})")
+    parser.add_argument('--video-workers', type=int, default=VIDEO_WORKERS,
+                        help=f"videos downloaded at the same time (default: {VIDEO_WORKERS})")
+    parser.add_argument('--fragment-budget', type=int, default=VIDEO_FRAGMENT_BUDGET,
+                        help=f"fragment connections shared by all running videos (default: {VIDEO_FRAGMENT_BUDGET})")
+    parser.add_argument('--video-rate-limit', type=parse_rate,
+                        help="aggregate video bandwidth limit, e.g. 20M (bytes/sec)")
+    parser.add_argument('--report', metavar='PATH',
+                        help="write a run report with throughput and latency numbers (.json or .csv)")
+    parser.add_argument('--prometheus', metavar='PATH',
+                        help="also write the run metrics in Prometheus text format")
+    parser.add_argument('--verify', action='store_true',
+                        help="rescan the download directory and forget outputs that are missing or truncated")
+    parser.add_argument('--sync', action='store_true',
+                        help="only download lessons that are new or changed since the last --sync run")
+    args = parser.parse_args(argv)
+    if args.config:
+        try:
+            with open(args.config, 'r', encoding='utf-8') as f:
+                config = {key.replace('-', '_'): value for key, value in json.load(f).items()}
+        except (OSError, ValueError) as e:
+            parser.error(f"could not read config file {args.config}: {e}")
+        known = {action.dest for action in parser._actions}
+        unknown = sorted(set(config) - known - {'config'})
+        if unknown:
+            parser.error(f"unknown option(s) in {args.config}: {', '.join(unknown)}")
+        # Re-parse with the file's values as defaults so the command line wins; repeatable
+        # options are filled in afterwards so command line values replace the file's list
+        repeatable = {action.dest for action in parser._actions if isinstance(action, argparse._AppendAction)}
+        parser.set_defaults(**{key: value for key, value in config.items() if key not in repeatable})
+        args = parser.parse_args(argv)
+        for key in repeatable & set(config):
+            if getattr(args, key) is None:
+                setattr(args, key, [config[key]] if isinstance(config[key], str) else config[key])
+    # Config files may give priorities as {slug: n}
+    priorities = {}
+    entries = args.priority or []
+    if isinstance(entries, dict):
+        entries = [f"{slug}={n}" for slug, n in entries.items()]
+    for entry in entries:
+        slug, _, value = entry.rpartition('=')
+        try:
+            priorities[slug] = int(value)
+        except ValueError:
+            parser.error(f"invalid priority: {entry} (expected SLUG=N)")
+        if not slug:
+            parser.error(f"invalid priority: {entry} (expected SLUG=N)")
+    args.priority = priorities
+    # One or more variants, e.g. "1080p,480p"; config files may also give a list
+    qualities = args.quality.split(',') if isinstance(args.quality, str) else args.quality
+    args.quality = []
+    for quality in qualities:
+        quality = str(quality).strip().lower()
+        if not re.fullmatch(r'\d+p?', quality):
+            parser.error(f"invalid quality: {quality} (expected e.g. 720p or 1080p,480p)")
+        quality = quality.rstrip('p') + 'p'
+        if quality not in args.quality:
+            args.quality.append(quality)
+    if args.all and not args.course:
+        args.course = ['*']
+    return args
+
+
+def configure_downloader(downloader, args):
+    """Apply command line options to a downloader."""
+    if args.async_http:
+        downloader.use_async_http()
+    downloader.cache.refresh = args.refresh
+    downloader.chunk_size = args.chunk_size
+    if args.convert_workers > 0:
+        downloader.converter = ConversionPool(args.convert_workers)
+    downloader.video_qualities = args.quality
+    downloader.disk.min_free = args.min_free
+    downloader.videos = VideoOrchestrator(args.video_workers, args.fragment_budget, args.video_rate_limit,
+                                          downloader.disk)
+    if args.verify:
+        downloader.manifest.verify()
+
+
+def prompt_modules(modules):
+    """Show a course's modules and ask which to download. Returns [(number, module)]."""
+    print("\nModules:")
+    for i, m in enumerate(modules):
+        print(f"  {i+1}. {m['title']} ({m.get('lessons_count', 0)} lessons)")
+        
+    mod_choice = input("\nEnter module number (or 'A' for All): ").strip().upper()
+    
+    if mod_choice == 'A':
+        return [(i+1, m) for i, m in enumerate(modules)]
+    elif mod_choice.isdigit():
+        idx = int(mod_choice) - 1
+        if 0 <= idx < len(modules):
+            return [(idx+1, modules[idx])]
+    return []
+
+
+def module_dirs(downloader, course_title, modules):
+    """Map each module id to its numbered output directory."""
+    course_dir = os.path.join(DOWNLOAD_DIR, downloader.sanitize_filename(course_title))
+    return {m.get('id'): os.path.join(course_dir, f"{i+1}. {downloader.sanitize_filename(m.get('title', 'Unknown Module'))}")
+            for i, m in enumerate(modules)}
+
+
+def iter_course_details(downloader, courses, lookahead):
+    """Yield (course, details) in order, fetching at most `lookahead` course trees ahead."""
+    return bounded_map(lambda course: (course, downloader.get_course_details(course['slug'])), courses, lookahead)
+
+
+def print_plan(downloader, courses_to_process, select_modules=None):
+    """Print the lessons a run would download per course, with estimated sizes, without downloading."""
+    print(f"\n{'='*60}")
+    print("Download Plan")
+    print(f"{'='*60}")
+    total_courses = total_lessons = total_pending = total_bytes = 0
+    for course, details in iter_course_details(downloader, courses_to_process, CATALOG_WORKERS):
+        if not details:
+            print(f"  {course['title']}: could not fetch course details")
+            continue
+        modules = details.get('modules', [])
+        modules_to_dl = select_modules(modules) if select_modules else [(i+1, m) for i, m in enumerate(modules)]
+        dir_map = module_dirs(downloader, course['title'], modules)
+        lessons = videos = pending = size = 0
+        for _, module in modules_to_dl:
+            for lesson in module.get('lessons', []):
+                lessons += 1
+                videos += lesson_kind(lesson) == 'video'
+                if not downloader.lesson_output_exists(lesson, dir_map[module.get('id')]):
+                    pending += 1
+                    size += sum(estimate_lesson_bytes(lesson, q) for q in downloader.video_qualities)
+        print(f"  {course['title']} [{course['slug']}]: {len(modules_to_dl)} modules, {lessons} lessons "
+              f"({videos} video), {pending} to download, ~{size / 1048576:.0f} MB")
+        total_courses += 1
+        total_lessons += lessons
+        total_pending += pending
+        total_bytes += size
+    print(f"\nTotal: {total_courses} courses, {total_lessons} lessons, "
+          f"{total_pending} to download, ~{total_bytes / 1048576:.0f} MB")
+
+
+def download_courses(downloader, courses_to_process, args, select_modules=None):
+    """Queue the lessons of every course on one scheduler and wait for them all.
+
+    courses_to_process can be any iterable, including a lazy one. Course
+    trees are fetched just ahead of use and dropped once their lessons are
+    queued; the scheduler queues are bounded, so memory stays flat however
+    many courses are processed. select_modules(modules) picks the modules to
+    download; without it all modules of each course are downloaded.
+    """
+    scheduler = DownloadScheduler(downloader, video_workers=args.video_workers, text_workers=args.text_workers,
+                                  policy=args.policy, priorities=args.priority, control_file=args.control)
+    sync_state = SyncState(downloader.manifest, downloader.video_suffixes()) if args.sync else None
+
+    try:
+        for selected, details in iter_course_details(downloader, courses_to_process, COURSE_DETAILS_LOOKAHEAD):
+            print(f"\n{'='*60}")
+            print(f"Processing Course: {selected['title']}")
+            print(f"{'='*60}")
+            
+            if not details:
+                continue
+
+            modules = details.get('modules', [])
+            course_slug = selected['slug']
+            course_title = selected['title']
+            
+            if select_modules:
+                modules_to_dl = select_modules(modules)
+            else:
+                # Automatic "All Modules" for bulk course download
+                print(f"  Auto-selecting all {len(modules)} modules...")
+                modules_to_dl = [(i+1, m) for i, m in enumerate(modules)]
+
+            if not modules_to_dl:
+                continue
+            
+            # 1. Create ALL module directories with serial numbers
+            module_dir_map = module_dirs(downloader, selected['title'], modules)
+            for module_path in module_dir_map.values():
+                downloader.manifest.ensure_dir(module_path)
+
+            course_id = details.get('id') # Available in details
+
+            # 2. Collect lessons of selected modules
+            if sync_state:
+                course_tree = [(lesson, m.get('id'), module_dir_map.get(m.get('id')))
+                               for m in modules for lesson in m.get('lessons', [])]
+                selected_ids = {str(lesson.get('id')) for _, m in modules_to_dl for lesson in m.get('lessons', [])}
+                lesson_jobs = sync_state.plan(course_slug, course_tree, selected_ids, downloader.sanitize_filename)
+            else:
+                lesson_jobs = []
+                for idx, module in modules_to_dl:
+                    module_id = module.get('id')
+                    # Use the pre-created path
+                    module_dir = module_dir_map.get(module_id)
+                
+                    print(f"\n  Module: {os.path.basename(module_dir)}")
+                
+                    lesson_jobs.extend((lesson, module_id, module_dir) for lesson in module.get('lessons', []))
+
+            # 3. Queue them with the course's pending size, which orders courses under --policy sjf
+            course_bytes = sum(sum(estimate_lesson_bytes(lesson, q) for q in downloader.video_qualities)
+                               for lesson, _, module_dir in lesson_jobs
+                               if not downloader.lesson_output_exists(lesson, module_dir))
+            for lesson, module_id, module_dir in lesson_jobs:
+                scheduler.submit(lesson, course_slug, course_title, module_id, module_dir, course_id, course_bytes)
+
+        # Wait for every queued lesson across all courses
+        scheduler.join()
+        if downloader.failed_lessons:
+            print(f"\n{len(downloader.failed_lessons)} lesson(s) failed after retries:")
+            for course_slug, lesson_title, reason in downloader.failed_lessons:
+                print(f"  [{course_slug}] {lesson_title}: {reason}")
+    except KeyboardInterrupt:
+        scheduler.cancel()
+        raise
+    if sync_state:
+        sync_state.commit(downloader.progress)
+
+
 def main():
+    args = parse_args()
+    headless = bool(args.course)
     print("KodeKloud Downloader v2.3 (HTML to Markdown)")
     
     # Check for cookie file or prompt for token
-    cookie_path = 'cookie.txt'
-    token = None
+    cookie_path = args.cookies
+    token_input = args.token or os.environ.get('KODEKLOUD_TOKEN')
     
-    if os.path.exists(cookie_path):
+    if token_input:
+        downloader = KodeKloudDownloader(None)
+    elif os.path.exists(cookie_path):
         print(f"Found '{cookie_path}'. Loading...")
         downloader = KodeKloudDownloader(cookie_path)
+    elif headless:
+        print(f"'{cookie_path}' not found and no --token given. Exiting.")
+        return
     else:
         print(f"'{cookie_path}' not found.")
         token_input = input("Enter your Session Cookie (token) OR path to cookie file: ").strip()
         if os.path.isfile(token_input):
             downloader = KodeKloudDownloader(token_input)
+            token_input = None
         else:
             # Assume it's a raw token string
-            # We need to initialize downloader with dummy file or None and set token manually
-            # But the class expects a file. Let's modify the class slightly or mock it.
-            # Easier: Just pass None and set the token/cookie.
             downloader = KodeKloudDownloader(None)
-            downloader.token = token_input
-            downloader.session.cookies.set('session-cookie', token_input)
-            downloader.session.headers.update({'Authorization': f'Bearer {token_input}'})
+    if token_input:
+        # No cookie file: set the token on the session directly
+        downloader.token = token_input
+        downloader.session.cookies.set('session-cookie', token_input)
+        downloader.session.headers.update({'Authorization': f'Bearer {token_input}'})
             
     if not downloader.token:
         print("No valid token/cookie provided. Exiting.")
         return
 
-    print("Fetching course list...")
-    courses = downloader.get_all_courses()
-    if not courses:
-        print("No courses found.")
-        return
-
-    print(f"\nFound {len(courses)} courses.")
-    
-    # Always show all courses (no search prompt)
-    filtered_courses = courses
+    configure_downloader(downloader, args)
 
-    print(f"\n0. Download All Courses ({len(filtered_courses)} courses)")
-    for i, c in enumerate(filtered_courses):
-        print(f"{i+1}. {c['title']}")
-        
+    print("Fetching course list...")
     try:
-        choice_str = input("\nEnter course number(s) (e.g., '1-10, 15, 16-19' or '0' for All): ").strip()
-        
-        courses_to_process = []
-        if choice_str == '0':
-            courses_to_process = filtered_courses
+        if args.list:
+            for i, c in enumerate(downloader.iter_courses(args.page_size)):
+                print(f"{i+1}. {c['title']} [{c['slug']}]")
+            return
+
+        if headless:
+            # Stream the catalog: courses are matched and queued while later pages are still loading
+            choice_str = ', '.join(args.course)
+            numbered = ((i+1, c) for i, c in enumerate(downloader.iter_courses(args.page_size))
+                        if course_matches(c, args.course))
         else:
-            # Parse range/comma-separated input
-            selected_indices = parse_selection_input(choice_str, len(filtered_courses))
-            if selected_indices is None:
-                print("Invalid selection.")
+            courses = downloader.get_all_courses(args.page_size)
+            if not courses:
+                print("No courses found.")
                 return
-            courses_to_process = [filtered_courses[i] for i in selected_indices]
-        
-        if not courses_to_process:
-             print("Invalid selection.")
-             return
 
-        for selected in courses_to_process:
-            print(f"\n{'='*60}")
-            print(f"Processing Course: {selected['title']}")
-            print(f"{'='*60}")
-            
-            details = downloader.get_course_details(selected['slug'])
-            if not details:
-                continue
+            print(f"\nFound {len(courses)} courses.")
 
-            modules = details.get('modules', [])
-            course_slug = selected['slug']
-            course_title = selected['title']
-            
-            # Always show all modules (no search prompt)
-            modules_to_dl = []
-            if len(courses_to_process) > 1:
-                # Automatic "All Modules" for bulk course download
-                print(f"  Auto-selecting all {len(modules)} modules...")
-                modules_to_dl = [(i+1, m) for i, m in enumerate(modules)]
-            else:
-                # Single course selection - Show all modules and prompt
-                print("\nModules:")
-                for i, m in enumerate(modules):
-                    print(f"  {i+1}. {m['title']} ({m.get('lessons_count', 0)} lessons)")
-                    
-                mod_choice = input("\nEnter module number (or 'A' for All): ").strip().upper()
-                
-                if mod_choice == 'A':
-                    modules_to_dl = [(i+1, m) for i, m in enumerate(modules)]
-                elif mod_choice.isdigit():
-                    idx = int(mod_choice) - 1
-                    if 0 <= idx < len(modules):
-                        modules_to_dl = [(idx+1, modules[idx])]
+            print(f"\n0. Download All Courses ({len(courses)} courses)")
+            for i, c in enumerate(courses):
+                print(f"{i+1}. {c['title']}")
 
-            if not modules_to_dl:
-                continue
+            choice_str = input("\nEnter course number(s) (e.g., '1-10, 15, 16-19' or '0' for All): ").strip()
             
-            # Output Directory
-            course_dir = os.path.join(DOWNLOAD_DIR, downloader.sanitize_filename(selected['title']))
+            if choice_str == '0':
+                selected_indices = range(len(courses))
+            else:
+                # Parse range/comma-separated input
+                selected_indices = parse_selection_input(choice_str, len(courses))
+                if selected_indices is None:
+                    print("Invalid selection.")
+                    return
             
-            # 1. Create ALL module directories with serial numbers
-            module_dir_map = {} # Map module_id to its created directory path
-            for i, m in enumerate(modules):
-                module_title = m.get('title', 'Unknown Module')
-                module_dir_name = f"{i+1}. {downloader.sanitize_filename(module_title)}"
-                module_path = os.path.join(course_dir, module_dir_name)
-                os.makedirs(module_path, exist_ok=True)
-                module_dir_map[m.get('id')] = module_path
-
-            # 2. Process selected modules
-            for idx, module in modules_to_dl:
-                module_title = module.get('title', 'Unknown Module')
-                module_id = module.get('id')
-                # Use the pre-created path
-                module_dir = module_dir_map.get(module_id)
-                
-                print(f"\n  Module: {os.path.basename(module_dir)}")
-                
-                lessons = module.get('lessons', [])
-                for lesson in lessons:
-                    course_id = details.get('id') # Available in details
-                    downloader.download_lesson(lesson, course_slug, course_title, module_id, module_dir, course_id)
-                    
-        
+            if not selected_indices:
+                 print("Invalid selection.")
+                 return
+            numbered = [(i+1, courses[i]) for i in selected_indices]
+
+        if args.module:
+            select_modules = module_filter(args.module)
+        elif not headless and len(numbered) == 1:
+            select_modules = prompt_modules
+        else:
+            select_modules = None
+
+        if args.shard:
+            print(f"Shard {args.shard[0]}/{args.shard[1]}")
+            numbered = ((n, c) for n, c in numbered if in_shard(c['slug'], args.shard))
+
+        # Catalog number and title of every course handed to the run, for the summary
+        processed = []
+
+        def courses_to_process():
+            for number, course in numbered:
+                processed.append((number, course['title']))
+                yield course
+
+        if args.dry_run:
+            print_plan(downloader, courses_to_process(), select_modules)
+            return
+
+        # Measure throughput from here so time spent at the prompts is not counted
+        downloader.metrics.started = time.time()
+        download_courses(downloader, courses_to_process(), args, select_modules=select_modules)
+        if not processed:
+            print(f"No courses match: {choice_str}")
+            return
+
         # Display summary
         print(f"\n{'='*60}")
         print("Download Summary")
         print(f"{'='*60}")
         print(f"User Input: {choice_str}")
-        print(f"Total Courses Downloaded: {len(courses_to_process)}")
+        print(f"Total Courses Downloaded: {len(processed)}")
         print("\nCourses:")
-        for idx, course in enumerate(courses_to_process, 1):
-            # Find original index in filtered_courses
-            original_idx = filtered_courses.index(course) + 1
-            print(f"  {original_idx}. {course['title']}")
+        for number, title in processed:
+            print(f"  {number}. {title}")
+        print()
+        downloader.metrics.print_summary()
+        if args.report:
+            downloader.metrics.write_report(args.report)
+            print(f"Report written to {args.report}")
+        if args.prometheus:
+            downloader.metrics.write_prometheus(args.prometheus)
         print(f"\n{'='*60}")
         print("All downloads completed!")
 
@@ -617,6 +3069,8 @@ def main():
         print("Invalid input.")
     except KeyboardInterrupt:
         print("\nAborted.")
+    finally:
+        downloader.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,45 @@
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kodekloud_downloader as kd
+
+URL = 'https://cdn.example.com/pod.png'
+
+
+def fetch_in_process(root, dest, log):
+    def download(url, tmp_path):
+        with open(log, 'a') as f:
+            f.write(f'{os.getpid()}\n')
+        with open(tmp_path, 'wb') as f:
+            f.write(b'png')
+        time.sleep(0.3)
+        return hashlib.sha256(b'png').hexdigest()
+
+    store = kd.AssetStore(root)
+    assert store.fetch(URL, dest, download)
+    store.close()
+
+
+def test_processes_sharing_a_store_fetch_a_url_once(tmp_path):
+    root = str(tmp_path / '.assets')
+    kd.AssetStore(root).close()
+    log = str(tmp_path / 'downloads.log')
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=fetch_in_process, args=(root, str(tmp_path / f'{i}.png'), log))
+               for i in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0, 0]
+    with open(log) as f:
+        assert len(f.read().split()) == 1
+    for i in range(2):
+        with open(tmp_path / f'{i}.png', 'rb') as f:
+            assert f.read() == b'png'
+    assert os.listdir(os.path.join(root, 'tmp')) == ['.lock']
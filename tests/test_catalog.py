@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kodekloud_downloader as kd
+
+
+def catalog(total, page_size, metadata):
+    """A fake _fetch_courses_page over `total` courses; metadata(page, pages) adds the reported fields."""
+    pages = -(-total // page_size)
+    requested = []
+
+    def fetch(page, limit):
+        requested.append(page)
+        if page > pages:
+            return {'courses': [], 'metadata': {'next_page': None}}
+        courses = list(range((page - 1) * limit, min(total, page * limit)))
+        return {'courses': courses, 'metadata': dict(metadata(page, pages),
+                                                     next_page=page + 1 if page < pages else None)}
+    return fetch, requested
+
+
+@pytest.mark.parametrize('metadata', [
+    lambda page, pages: {'total_pages': pages},
+    lambda page, pages: {'total_count': 23},
+    lambda page, pages: {'count': 5},            # Courses on this page, not in the catalog
+    lambda page, pages: {'total': 7},            # Too low
+    lambda page, pages: {},
+])
+def test_iter_courses_returns_whole_catalog(metadata):
+    downloader = kd.KodeKloudDownloader.__new__(kd.KodeKloudDownloader)
+    downloader._fetch_courses_page, requested = catalog(23, 5, metadata)
+    assert list(downloader.iter_courses(5)) == list(range(23))
+    assert sorted(requested) == [1, 2, 3, 4, 5]
+
+
+def test_total_pages_must_agree_with_next_page():
+    assert kd.KodeKloudDownloader._total_pages({'count': 50, 'next_page': 2}, 50) is None
+    assert kd.KodeKloudDownloader._total_pages({'pages': 4, 'next_page': None}, 50) == 1
+    assert kd.KodeKloudDownloader._total_pages({'total': 120, 'next_page': 2}, 50) == 3
+    assert kd.KodeKloudDownloader._total_pages({'total': 120}, 50) == 3
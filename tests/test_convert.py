@@ -0,0 +1,39 @@
+import os
+import sys
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kodekloud_downloader as kd
+
+
+def test_markdown_links_inside_html_are_rewritten():
+    content = ('<p>Intro <img src="https://cdn.example.com/a/pod.png"></p>\n'
+               '<p>![diagram](https://cdn.example.com/b/pod.png)</p>\n'
+               '<p>[Slides](https://cdn.example.com/slides.pdf) and [docs](https://example.com/docs)</p>')
+    markdown, assets = kd.convert_lesson_content(content)
+    assert assets == [('https://cdn.example.com/a/pod.png', 'pod.png'),
+                      ('https://cdn.example.com/b/pod.png', 'pod_1.png'),
+                      ('https://cdn.example.com/slides.pdf', 'slides.pdf')]
+    assert '](https://cdn.example.com' not in markdown
+    assert f'![diagram]({quote("pod_1.png")})' in markdown
+    assert '[docs](https://example.com/docs)' in markdown
+
+
+def test_plain_markdown_links_are_rewritten():
+    markdown, assets = kd.convert_lesson_content('![x](https://cdn.example.com/my image.png)')
+    assert markdown == '![x](my%20image.png)'
+    assert assets == [('https://cdn.example.com/my image.png', 'my image.png')]
+
+
+def test_conversion_pool_survives_a_dead_worker():
+    pool = kd.ConversionPool(1)
+    try:
+        assert pool.convert('<p>one</p>')[0].strip() == 'one'
+        for process in list(pool._executor._processes.values()):
+            process.kill()
+            process.join()
+        assert pool.convert('<p>two</p>')[0].strip() == 'two'
+        assert pool.convert('<p>three</p>')[0].strip() == 'three'
+    finally:
+        pool.close()
@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kodekloud_downloader as kd
+
+
+def make_downloader(tmp_path, monkeypatch, payloads):
+    monkeypatch.chdir(tmp_path)
+    downloader = kd.KodeKloudDownloader(None)
+
+    def get(lesson_id, course_id):
+        time.sleep(0.2)  # Long enough for both workers to be inside download_lesson
+        return 200, payloads[lesson_id]
+
+    for prefetcher in downloader.prefetch.values():
+        prefetcher.close()
+    downloader.prefetch = {kind: types.SimpleNamespace(get=get, discard=lambda *args: None, close=lambda: None)
+                           for kind in ('video', 'text')}
+    return downloader
+
+
+def test_lessons_with_the_same_title_do_not_overwrite_each_other(tmp_path, monkeypatch):
+    downloader = make_downloader(tmp_path, monkeypatch, {1: {'content': '<p>first</p>'},
+                                                         2: {'content': '<p>second</p>'}})
+    module_dir = str(tmp_path / 'Downloads' / 'Course' / '1. Module')
+    os.makedirs(module_dir)
+    workers = [threading.Thread(target=downloader.download_lesson,
+                                args=({'id': lesson_id, 'title': 'Lab', 'type': 'text'}, 'course', 'Course', 1,
+                                      module_dir, 9))
+               for lesson_id in (1, 2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    counters = downloader.metrics.report()['counters']
+    downloader.close()
+    assert counters['lessons_downloaded'] == 1 and counters['lessons_skipped'] == 1
+    # Per-path locks are dropped once no worker holds them
+    assert len(downloader._path_locks) == 0 and len(downloader.assets._url_locks) == 0
+    with open(os.path.join(module_dir, 'Lab.md')) as f:
+        assert f.read().strip() in ('# Lab\n\nfirst', '# Lab\n\nsecond')
+
+
+def test_constructing_a_downloader_has_no_download_side_effects(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    threads = threading.active_count()
+    downloader = kd.KodeKloudDownloader(None)
+    assert threading.active_count() == threads
+    assert sorted(os.listdir(tmp_path)) == ['.cache']
+    downloader.close()
+    assert sorted(os.listdir(tmp_path)) == ['.cache']
+
+    downloader = kd.KodeKloudDownloader(None)
+    assert downloader.manifest is downloader.manifest
+    downloader.close()
+    assert os.path.exists(kd.OUTPUT_MANIFEST_FILE)
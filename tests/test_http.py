@@ -0,0 +1,233 @@
+import base64
+import email.utils
+import hashlib
+import http.server
+import os
+import sys
+import threading
+import time
+import types
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kodekloud_downloader as kd
+
+
+class StallingHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '10')
+        self.end_headers()
+        self.wfile.write(b'abc')
+        self.wfile.flush()
+        time.sleep(2)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stalling_url():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StallingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/file'
+    server.shutdown()
+
+
+@pytest.mark.parametrize('backend', ['requests', 'aiohttp'])
+def test_stalled_body_times_out(stalling_url, backend):
+    if backend == 'aiohttp':
+        if kd.aiohttp is None:
+            pytest.skip('aiohttp is not installed')
+        inner = kd.AsyncHTTPEngine(requests.Session())
+    else:
+        inner = requests.Session()
+    transport = kd.RetryingTransport(inner, kd.Metrics(), max_retries=0, timeout=(1, 0.3))
+    start = time.time()
+    with pytest.raises(kd.RESUMABLE_ERRORS):
+        with transport.get(stalling_url, stream=True) as response:
+            for _ in response.iter_content(1024):
+                pass
+    assert time.time() - start < 1.5
+    transport.close()
+
+
+BODY = os.urandom(200 * 1024)
+
+
+class TruncatingHandler(http.server.BaseHTTPRequestHandler):
+    """Serves BODY, cutting the first response off halfway; later requests honour Range."""
+
+    requests_seen = []
+    digest = base64.b64encode(hashlib.sha256(BODY).digest()).decode()
+
+    def do_GET(self):
+        requested = self.headers.get('Range')
+        self.requests_seen.append(requested)
+        offset = int(requested[len('bytes='):-1]) if requested else 0
+        self.send_response(206 if offset else 200)
+        self.send_header('Content-Length', str(len(BODY) - offset))
+        if offset:
+            self.send_header('Content-Range', f'bytes {offset}-{len(BODY) - 1}/{len(BODY)}')
+        self.send_header('Digest', f'sha-256={self.digest}')
+        self.end_headers()
+        if len(self.requests_seen) == 1:
+            self.wfile.write(BODY[:len(BODY) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(BODY[offset:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def truncating_server():
+    TruncatingHandler.requests_seen = []
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), TruncatingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/slides.pdf'
+    server.shutdown()
+
+
+def make_downloader(tmp_path):
+    downloader = kd.KodeKloudDownloader.__new__(kd.KodeKloudDownloader)
+    downloader.metrics = kd.Metrics()
+    downloader.http = kd.RetryingTransport(requests.Session(), downloader.metrics)
+    downloader.chunk_size = 8192
+    downloader.disk = kd.DiskSpaceGuard(str(tmp_path), min_free=0)
+    return downloader
+
+
+def test_cut_off_download_resumes_with_range(tmp_path, truncating_server):
+    downloader = make_downloader(tmp_path)
+    store = kd.AssetStore(str(tmp_path / '.assets'))
+    dest = str(tmp_path / 'slides.pdf')
+    assert store.fetch(truncating_server, dest, downloader._stream_to_file)
+    store.close()
+    first, resumed = TruncatingHandler.requests_seen
+    assert first is None and 0 < int(resumed[len('bytes='):-1]) <= len(BODY) // 2
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+    assert downloader.metrics.report()['counters']['asset_resumes'] == 1
+
+
+def test_checksum_mismatch_removes_partial_file(tmp_path, truncating_server, monkeypatch):
+    monkeypatch.setattr(TruncatingHandler, 'digest', base64.b64encode(b'0' * 32).decode())
+    downloader = make_downloader(tmp_path)
+    store = kd.AssetStore(str(tmp_path / '.assets'))
+    dest = str(tmp_path / 'slides.pdf')
+    assert not store.fetch(truncating_server, dest, downloader._stream_to_file)
+    store.close()
+    assert len(TruncatingHandler.requests_seen) == 2
+    assert os.listdir(tmp_path / '.assets' / 'tmp') == ['.lock']
+    assert not os.path.exists(dest)
+
+
+class ScriptedTransport:
+    """Returns (or raises) the scripted outcomes in order, one per request."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        status, headers = outcome if isinstance(outcome, tuple) else (outcome, {})
+        return types.SimpleNamespace(status_code=status, headers=headers, close=lambda: None)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(kd.time, 'sleep', delays.append)
+    return delays
+
+
+def test_throttled_and_server_errors_are_retried(sleeps):
+    metrics = kd.Metrics()
+    transport = kd.RetryingTransport(ScriptedTransport(503, 500, 200), metrics)
+    assert transport.get('https://example.com/api').status_code == 200
+    assert len(sleeps) == 2
+    counters = metrics.report()['counters']
+    assert counters['http_retries'] == 2 and counters['http_throttled'] == 1
+
+
+def test_last_error_response_is_returned_when_retries_run_out(sleeps):
+    transport = kd.RetryingTransport(ScriptedTransport(502, 502, 502), kd.Metrics(), max_retries=2)
+    assert transport.get('https://example.com/api').status_code == 502
+    assert len(sleeps) == 2
+
+
+def test_retry_after_seconds_and_http_date(sleeps):
+    later = email.utils.format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    transport = kd.RetryingTransport(
+        ScriptedTransport((429, {'Retry-After': '7'}), (503, {'Retry-After': later}), 200), kd.Metrics())
+    assert transport.get('https://example.com/api').status_code == 200
+    assert sleeps[0] == 7
+    assert 28 <= sleeps[1] <= 30
+
+
+@pytest.mark.parametrize('error', [requests.exceptions.MissingSchema('no schema'),
+                                   requests.exceptions.InvalidURL('bad url'),
+                                   requests.TooManyRedirects('loop'),
+                                   requests.exceptions.SSLError('bad certificate'),
+                                   ValueError('yarl rejected the URL')])
+def test_permanent_errors_are_not_retried_and_release_the_slot(sleeps, error):
+    limiter = kd.AdaptiveLimiter(initial=2, maximum=2)
+    inner = ScriptedTransport(error, error, 200)
+    transport = kd.RetryingTransport(inner, kd.Metrics(), limiter=limiter)
+    for _ in range(2):
+        with pytest.raises(type(error)):
+            transport.get('https://example.com/api')
+    assert inner.calls == 2 and sleeps == []
+    assert limiter._in_flight == 0
+    assert transport.get('https://example.com/api').status_code == 200
+
+
+def test_connection_errors_are_retried(sleeps):
+    inner = ScriptedTransport(requests.ConnectionError('reset'), requests.Timeout('slow'), 200)
+    assert kd.RetryingTransport(inner, kd.Metrics()).get('https://example.com/api').status_code == 200
+    assert inner.calls == 3
+
+
+def test_limiter_halves_once_per_second_and_recovers():
+    limiter = kd.AdaptiveLimiter(initial=8, maximum=8)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 4
+    limiter.acquire()
+    limiter.release(throttled=True)  # Same burst of rejections: no second halving
+    assert limiter.limit == 4
+    limiter._last_decrease -= 1.0
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 2
+    for _ in range(6):
+        limiter.acquire()
+        limiter.release()
+    assert 4 <= limiter.limit < 5
+    for _ in range(100):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 8
+
+
+def test_async_response_is_released_on_the_engine_loop(stalling_url):
+    if kd.aiohttp is None:
+        pytest.skip('aiohttp is not installed')
+    engine = kd.AsyncHTTPEngine(requests.Session())
+    # Debug mode raises on loop calls made from another thread, e.g. closing a half-read connection
+    engine.loop.set_debug(True)
+    try:
+        with engine.get(stalling_url, stream=True) as response:
+            assert next(response.iter_content(3)) == b'abc'
+    finally:
+        engine.close()
@@ -0,0 +1,79 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kodekloud_downloader as kd
+
+
+def open_store(tmp_path, compact_every=100):
+    return kd.ProgressStore(str(tmp_path / 'progress.json'), str(tmp_path / 'progress.journal'), compact_every)
+
+
+def journal_line(lesson_id):
+    return json.dumps({'course': 'k8s', 'title': 'K8s', 'module': '1', 'lesson': str(lesson_id)}) + '\n'
+
+
+def test_existing_progress_file_loads_without_migration(tmp_path):
+    with open(tmp_path / 'progress.json', 'w') as f:
+        json.dump({'last_updated': '2024-01-01T00:00:00Z', 'courses': {'k8s': {
+            'title': 'K8s', 'completed_modules': [], 'completed_lessons': {'1': ['10', '11'], '2': ['20']}}}}, f)
+    store = open_store(tmp_path)
+    assert store.is_completed('k8s', 1, 10) and store.is_completed('k8s', '2', '20')
+    assert not store.is_completed('k8s', 1, 12)
+    store.close()
+
+
+def test_journal_is_replayed_and_folded_into_the_snapshot(tmp_path):
+    with open(tmp_path / 'progress.journal', 'w') as f:
+        f.write(journal_line(10) + journal_line(11))
+    store = open_store(tmp_path)
+    assert store.is_completed('k8s', 1, 11)
+    store.close()
+    assert os.path.getsize(tmp_path / 'progress.journal') == 0
+    with open(tmp_path / 'progress.json') as f:
+        assert sorted(json.load(f)['courses']['k8s']['completed_lessons']['1']) == ['10', '11']
+
+
+def test_torn_last_line_does_not_swallow_the_next_completion(tmp_path):
+    store = open_store(tmp_path, compact_every=1)
+    store.mark_completed('k8s', 'K8s', 1, 10)
+    # Crash while appending the next line, after lesson 10 was compacted
+    store._journal.close()
+    with open(tmp_path / 'progress.journal', 'a') as f:
+        f.write(journal_line(99)[:20])
+
+    store = open_store(tmp_path)
+    assert store.is_completed('k8s', 1, 10) and not store.is_completed('k8s', 1, 99)
+    store.mark_completed('k8s', 'K8s', 1, 11)
+    store._journal.close()  # Crash again
+
+    store = open_store(tmp_path)
+    assert store.is_completed('k8s', 1, 10) and store.is_completed('k8s', 1, 11)
+    store.close()
+
+
+def test_compaction_every_n_completions(tmp_path):
+    store = open_store(tmp_path, compact_every=2)
+    store.mark_completed('k8s', 'K8s', 1, 10)
+    assert os.path.getsize(tmp_path / 'progress.journal') > 0
+    store.mark_completed('k8s', 'K8s', 1, 11)
+    assert os.path.getsize(tmp_path / 'progress.journal') == 0
+    with open(tmp_path / 'progress.json') as f:
+        assert sorted(json.load(f)['courses']['k8s']['completed_lessons']['1']) == ['10', '11']
+    # Marking a lesson twice writes nothing
+    store.mark_completed('k8s', 'K8s', 1, 11)
+    assert os.path.getsize(tmp_path / 'progress.journal') == 0
+    store.close()
+
+
+def test_stores_sharing_files_merge_on_compaction(tmp_path):
+    first, second = open_store(tmp_path), open_store(tmp_path)
+    first.mark_completed('k8s', 'K8s', 1, 10)
+    second.mark_completed('k8s', 'K8s', 2, 20)
+    first.close()
+    second.close()
+    store = open_store(tmp_path)
+    assert store.is_completed('k8s', 1, 10) and store.is_completed('k8s', 2, 20)
+    store.close()
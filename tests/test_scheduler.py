@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kodekloud_downloader as kd
+
+
+class StubDownloader:
+    def __init__(self):
+        self.downloaded = []
+        self.metrics = kd.Metrics()
+        self.prefetch = {kind: types.SimpleNamespace(schedule=lambda *args: None) for kind in ('video', 'text')}
+
+    def lesson_output_exists(self, lesson, output_dir):
+        return True
+
+    def download_lesson(self, lesson, *args):
+        self.downloaded.append(lesson['id'])
+
+
+def test_bad_control_file_is_ignored(tmp_path, monkeypatch):
+    monkeypatch.setattr(kd, 'CONTROL_POLL_INTERVAL', 0)
+    control = tmp_path / 'control.json'
+    control.write_text(json.dumps({'priorities': {'b': 5}}))
+    downloader = StubDownloader()
+    scheduler = kd.DownloadScheduler(downloader, 1, 1, control_file=str(control))
+    assert scheduler.priorities == {'b': 5}
+
+    for content in ([1, 2], {'priorities': {'a': 'high'}}, {'priorities': ['a']}, {'policy': ['sjf']}):
+        control.write_text(json.dumps(content))
+        os.utime(control, (scheduler._control_mtime + 1, scheduler._control_mtime + 1))
+        scheduler._check_control()
+        assert scheduler.priorities == {'b': 5} and scheduler.policy == 'fifo'
+
+    for lesson_id in (1, 2):
+        scheduler.submit({'id': lesson_id, 'type': 'text'}, 'a', 'A', 1, str(tmp_path), 9)
+    scheduler.join()
+    assert downloader.downloaded == [1, 2]
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_prefetch_follows_dequeue_order():
+    fetched = []
+    upcoming = [(lesson_id, 1) for lesson_id in reversed(range(10))]
+
+    def fetch(lesson_id, course_id):
+        fetched.append(lesson_id)
+        return 200, {'id': lesson_id}
+
+    prefetcher = kd.LessonPrefetcher(fetch, lookahead=2, workers=1, order=lambda n: upcoming[:n])
+    for lesson_id in range(10):
+        prefetcher.schedule(lesson_id, 1)
+    assert wait_for(lambda: fetched == [9, 8])
+    time.sleep(0.1)
+    assert fetched == [9, 8]
+
+    upcoming.pop(0)
+    assert prefetcher.get(9, 1) == (200, {'id': 9})
+    assert wait_for(lambda: fetched == [9, 8, 7])
+    # Not prefetched yet: fetched inline
+    assert prefetcher.get(0, 1) == (200, {'id': 0})
+    prefetcher.close()
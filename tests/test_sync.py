@@ -0,0 +1,95 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kodekloud_downloader as kd
+
+
+def write(manifest, path):
+    manifest.ensure_dir(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(path)
+    manifest.add(path)
+
+
+def sync_once(tmp_path, manifest, tree):
+    sync = kd.SyncState(manifest, state_dir=str(tmp_path / '.sync'))
+    ids = {str(lesson['id']) for lesson, _, _ in tree}
+    scheduled = sync.plan('course', tree, ids, kd.sanitize_filename)
+    progress = types.SimpleNamespace(completed_this_run={('course', str(m), str(l['id'])) for l, m, _ in scheduled})
+    sync.commit(progress)
+    return scheduled
+
+
+def test_module_rename_reschedules_text_and_moves_video(tmp_path):
+    manifest = kd.OutputManifest(str(tmp_path / 'manifest.jsonl'))
+    old_dir, new_dir = str(tmp_path / '01 - Intro'), str(tmp_path / '01 - Basics')
+    text = {'id': 1, 'title': 'Setup', 'type': 'text', 'updated_at': 'a'}
+    video = {'id': 2, 'title': 'Tour', 'type': 'video', 'updated_at': 'a'}
+    assert len(sync_once(tmp_path, manifest, [(text, 10, old_dir), (video, 10, old_dir)])) == 2
+    for name in ('Setup.md', 'diagram.png', 'Tour.mkv', 'Tour.en.vtt'):
+        write(manifest, os.path.join(old_dir, name))
+
+    scheduled = sync_once(tmp_path, manifest, [(text, 10, new_dir), (video, 10, new_dir)])
+
+    assert [lesson['id'] for lesson, _, _ in scheduled] == [1]
+    assert sorted(os.listdir(new_dir)) == ['Tour.en.vtt', 'Tour.mkv']
+    assert not os.path.exists(old_dir)
+    assert not manifest.has(os.path.join(old_dir, 'diagram.png'))
+
+
+def test_old_folder_with_unselected_lessons_is_kept(tmp_path):
+    manifest = kd.OutputManifest(str(tmp_path / 'manifest.jsonl'))
+    old_dir, new_dir = str(tmp_path / '01 - Intro'), str(tmp_path / '01 - Basics')
+    first = {'id': 1, 'title': 'Setup', 'type': 'text', 'updated_at': 'a'}
+    second = {'id': 2, 'title': 'Next', 'type': 'text', 'updated_at': 'a'}
+    sync_once(tmp_path, manifest, [(first, 10, old_dir), (second, 10, old_dir)])
+    write(manifest, os.path.join(old_dir, 'Next.md'))
+
+    sync = kd.SyncState(manifest, state_dir=str(tmp_path / '.sync'))
+    sync.plan('course', [(first, 10, new_dir), (second, 10, new_dir)], {'1'}, kd.sanitize_filename)
+
+    assert os.path.exists(os.path.join(old_dir, 'Next.md'))
+
+
+def test_plan_keeps_no_fingerprints_in_memory_and_commit_drops_failed_lessons(tmp_path):
+    manifest = kd.OutputManifest(str(tmp_path / 'manifest.jsonl'))
+    module_dir = str(tmp_path / '01 - Intro')
+    done = {'id': 1, 'title': 'Setup', 'type': 'text', 'updated_at': 'a'}
+    failed = {'id': 2, 'title': 'Next', 'type': 'text', 'updated_at': 'a'}
+    sync = kd.SyncState(manifest, state_dir=str(tmp_path / '.sync'))
+    sync.plan('course', [(done, 10, module_dir), (failed, 10, module_dir)], {'1', '2'}, kd.sanitize_filename)
+    assert sync._planned == ['course']
+
+    sync.commit(types.SimpleNamespace(completed_this_run={('course', '10', '1')}))
+    assert os.listdir(tmp_path / '.sync') == ['course.json']
+    assert set(sync._load('course')) == {'1'}
+
+
+def test_old_copies_are_kept_until_the_replacement_completes(tmp_path):
+    manifest = kd.OutputManifest(str(tmp_path / 'manifest.jsonl'))
+    old_dir, new_dir = str(tmp_path / '01 - Intro'), str(tmp_path / '01 - Basics')
+    changed = {'id': 1, 'title': 'Setup', 'type': 'text', 'updated_at': 'a'}
+    moved = {'id': 2, 'title': 'Next', 'type': 'text', 'updated_at': 'a'}
+    sync_once(tmp_path, manifest, [(changed, 10, new_dir), (moved, 10, old_dir)])
+    write(manifest, os.path.join(new_dir, 'Setup.md'))
+    write(manifest, os.path.join(old_dir, 'Next.md'))
+
+    changed = dict(changed, updated_at='b')
+    tree = [(changed, 10, new_dir), (moved, 10, new_dir)]
+    sync = kd.SyncState(manifest, state_dir=str(tmp_path / '.sync'))
+    assert len(sync.plan('course', tree, {'1', '2'}, kd.sanitize_filename)) == 2
+    # The changed lesson is set aside so it gets downloaded; the moved one stays in the old folder
+    assert not os.path.exists(os.path.join(new_dir, 'Setup.md'))
+    assert os.path.exists(os.path.join(old_dir, 'Next.md'))
+
+    sync.commit(types.SimpleNamespace(completed_this_run=set()))
+    assert sorted(os.listdir(new_dir)) == ['Setup.md']
+    assert manifest.has(os.path.join(new_dir, 'Setup.md'))
+    assert os.listdir(old_dir) == ['Next.md']
+    # Both lessons keep their old fingerprint and are retried next time
+    assert [lesson['id'] for lesson, _, _ in sync_once(tmp_path, manifest, tree)] == [1, 2]
+    assert os.listdir(new_dir) == []
+    assert not os.path.exists(old_dir)
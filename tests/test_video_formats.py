@@ -0,0 +1,98 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kodekloud_downloader as kd
+
+
+def make_info():
+    formats = [
+        {'format_id': 'v1080', 'height': 1080, 'width': 1920, 'vcodec': 'avc1', 'acodec': 'none', 'tbr': 3000},
+        {'format_id': 'v720', 'height': 720, 'width': 1280, 'vcodec': 'avc1', 'acodec': 'none', 'tbr': 1500},
+        {'format_id': 'v480', 'height': 480, 'width': 854, 'vcodec': 'avc1', 'acodec': 'none', 'tbr': 800},
+        {'format_id': 'a', 'vcodec': 'none', 'acodec': 'mp4a', 'abr': 128},
+        {'format_id': 'c1080', 'height': 1080, 'width': 1920, 'vcodec': 'avc1', 'acodec': 'mp4a', 'tbr': 3200},
+    ]
+    for f in formats:
+        f.update({'url': f"https://example.invalid/{f['format_id']}", 'ext': 'mp4', 'protocol': 'https'})
+    return {'id': '42', 'title': 'Lesson', 'extractor': 'vimeo', 'extractor_key': 'Vimeo',
+            'webpage_url': 'https://player.vimeo.com/video/42', 'duration': 60, 'formats': formats}
+
+
+class Recorder:
+    def __init__(self, client, tmp_path, monkeypatch):
+        self.downloads = []
+        self.muxed = []
+        client.extract = lambda url, refresh=False: (make_info(), False)
+        ydl = client._ydl()
+
+        def process_info(info_dict):
+            path = str(tmp_path / f"{info_dict['format_id']}.mp4")
+            open(path, 'w').close()
+            info_dict['filepath'] = path
+            self.downloads.append(info_dict['format_id'])
+
+        monkeypatch.setattr(ydl, 'process_info', process_info)
+
+        def run(cmd, **kwargs):
+            self.muxed.append((os.path.basename(cmd[cmd.index('-i') + 1]), os.path.basename(cmd[-1])))
+            open(cmd[-1], 'w').close()
+
+        monkeypatch.setattr(kd.subprocess, 'run', run)
+
+
+def test_single_quality_uses_requested_height(tmp_path, monkeypatch):
+    client = kd.VideoClient(None)
+    recorder = Recorder(client, tmp_path, monkeypatch)
+    client.download('https://player.vimeo.com/video/42', str(tmp_path / 'Lesson'), kd.VideoOrchestrator(),
+                    {'480p': str(tmp_path / 'Lesson')})
+    assert recorder.downloads == ['v480+a']
+
+
+def test_variants_share_audio_in_one_pass(tmp_path, monkeypatch):
+    client = kd.VideoClient(None)
+    recorder = Recorder(client, tmp_path, monkeypatch)
+    variants = {'1080p': str(tmp_path / 'Lesson'), '480p': str(tmp_path / 'Lesson.480p')}
+    client.download('https://player.vimeo.com/video/42', str(tmp_path / 'Lesson'), kd.VideoOrchestrator(), variants)
+    assert sorted(recorder.downloads) == ['a', 'v1080', 'v480']
+    assert recorder.muxed == [('v1080.mp4', 'Lesson.tmp.mkv'), ('v480.mp4', 'Lesson.480p.tmp.mkv')]
+    assert os.path.exists(tmp_path / 'Lesson.mkv') and os.path.exists(tmp_path / 'Lesson.480p.mkv')
+
+
+def test_info_cache_is_bounded_and_dropped_after_download(tmp_path, monkeypatch):
+    client = kd.VideoClient(None, info_cache_size=2)
+    ydl = client._ydl()
+    monkeypatch.setattr(ydl, 'extract_info', lambda url, download=False: make_info())
+    for vimeo_id in ('1', '2', '3'):
+        client.extract(f'https://player.vimeo.com/video/{vimeo_id}')
+    assert list(client._info) == ['2', '3']
+
+    downloads = []
+    monkeypatch.setattr(ydl, 'process_info', lambda info_dict: downloads.append(info_dict['format_id']))
+    client.download('https://player.vimeo.com/video/3', str(tmp_path / 'Lesson'), kd.VideoOrchestrator(),
+                    {'480p': str(tmp_path / 'Lesson')})
+    assert downloads == ['v480+a']
+    assert list(client._info) == ['2']
+
+
+def test_overlapping_jobs_stay_within_budget_and_rate_limit():
+    orchestrator = kd.VideoOrchestrator(max_jobs=2, fragment_budget=15, rate_limit=14 * 1000,
+                                        disk=kd.DiskSpaceGuard(min_free=0))
+    first, second = {}, {}
+    with orchestrator.job(first):
+        first_share = dict(first)
+        with orchestrator.job(second):
+            # The running job keeps the share it started with; yt-dlp would not pick up a change anyway
+            assert first == first_share
+            fragments = first['concurrent_fragment_downloads'] + second['concurrent_fragment_downloads']
+            assert fragments <= 15
+            assert (first['ratelimit'] * first['concurrent_fragment_downloads']
+                    + second['ratelimit'] * second['concurrent_fragment_downloads']) <= 14 * 1000
+    assert first_share == {'concurrent_fragment_downloads': 7, 'ratelimit': 1000}
+
+
+def test_budget_smaller_than_workers_limits_running_videos():
+    orchestrator = kd.VideoOrchestrator(max_jobs=4, fragment_budget=2, disk=kd.DiskSpaceGuard(min_free=0))
+    assert orchestrator.max_jobs == 2
+    assert orchestrator.share() == (1, None)